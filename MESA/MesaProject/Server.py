@@ -1,7 +1,58 @@
+import os
 import mesa
+import numpy as np
+from collections import defaultdict
 
 from agents import *
 from model import StreetView
+from layers import BUILDING, PARKING, ROUNDABOUT
+from layout import load_layout
+
+# Layout the server shows, set STREET_LAYOUT_DIR to show another one (e.g. a generated city)
+LAYOUT_DIR = os.environ.get("STREET_LAYOUT_DIR", ".")
+# The canvas is sized from the layout, about 576 pixels on its longest side
+CANVAS_PIXELS = 576
+
+# Colours of the static map, drawn from the cell layers
+ROAD_COLOR = "#bec5cf"
+TERRAIN_COLORS = {BUILDING: "#0390fc", PARKING: "#fcf803", ROUNDABOUT: "#5e2a03"}
+
+
+def cell_portrayal(color, x, y):
+    return {"Color": [color, color, color], "Shape": "rect", "Filled": "true",
+            "Layer": 0, "w": 1, "h": 1, "x": x, "y": y}
+
+
+def terrain_portrayals(model):
+    """
+    Portrayals of the static map: the roads, then the buildings, parking spots and
+    roundabouts on top. The map isn't made of agents, so it is read from the model's layers.
+    """
+    layers = model.layers
+    portrayals = []
+    for x, y in zip(*np.nonzero(layers.directions)):
+        portrayals.append(cell_portrayal(ROAD_COLOR, int(x), int(y)))
+    for x, y in zip(*np.nonzero(np.isin(layers.terrain, list(TERRAIN_COLORS)))):
+        x, y = int(x), int(y)
+        portrayal = cell_portrayal(TERRAIN_COLORS[layers.terrain[x, y]], x, y)
+        if layers.terrain[x, y] == PARKING:
+            portrayal["text"] = str(model.layout.spot[x, y])
+            portrayal["text_color"] = "black"
+        portrayals.append(portrayal)
+    return portrayals
+
+
+class StreetCanvasGrid(mesa.visualization.CanvasGrid):
+    """
+    CanvasGrid that draws the static map under the agents (stoplights and cars).
+    """
+    def render(self, model):
+        grid_state = defaultdict(list)
+        for portrayal in terrain_portrayals(model):
+            grid_state[portrayal["Layer"]].append(portrayal)
+        for layer, portrayals in super().render(model).items():
+            grid_state[layer].extend(portrayals)
+        return grid_state
 
 
 def street_portrayal(agent):
@@ -10,40 +61,6 @@ def street_portrayal(agent):
 
     portrayal = {}
 
-    if type(agent) is Road:
-        portrayal["Color"] = ["#bec5cf", "#bec5cf", "#bec5cf"]
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 0
-        portrayal["w"] = 1
-        portrayal["h"] = 1
-
-    if type(agent) is Buildings:
-        portrayal["Color"] = ["#0390fc", "#0390fc", "#0390fc"]
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 0
-        portrayal["w"] = 1
-        portrayal["h"] = 1
-
-    if type(agent) is ParkingSpots:
-        portrayal["Color"] = ["#fcf803", "#fcf803", "#fcf803"]
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 0
-        portrayal["w"] = 1
-        portrayal["h"] = 1
-        portrayal["text"] = agent.number
-        portrayal["text_color"] = "black"
-
-    if type(agent) is RoundAbout:
-        portrayal["Color"] = ["#5e2a03", "#5e2a03", "#5e2a03"]
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 0
-        portrayal["w"] = 1
-        portrayal["h"] = 1
-
     if type(agent) is Stoplight:
         portrayal["Color"] = agent.color
         portrayal["Shape"] = "rect"
@@ -67,7 +84,10 @@ def street_portrayal(agent):
     return portrayal
 
 
-canvas_element = mesa.visualization.CanvasGrid(street_portrayal, 24, 24, 576, 576)
+layout = load_layout(LAYOUT_DIR)
+cell_pixels = max(1, CANVAS_PIXELS // max(layout.width, layout.height))
+canvas_element = StreetCanvasGrid(street_portrayal, layout.width, layout.height,
+                                  layout.width * cell_pixels, layout.height * cell_pixels)
 
 
 model_params = {
@@ -75,6 +95,7 @@ model_params = {
     "title": mesa.visualization.StaticText("- Parameters -"),
     "buildings": mesa.visualization.StaticText("Buildings (Blue)"),
     "parkingSpots": mesa.visualization.StaticText("Parking Spots (Yellow)"),
+    "layout_dir": LAYOUT_DIR,
     
 }
 
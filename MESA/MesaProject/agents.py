@@ -1,119 +1,65 @@
 import mesa
-import numpy as np
-import math
-import random
-import heapq
-import util
-
-class Road(mesa.Agent):
-    """
-    A Road Agent. Only traversable in a given trajectory.
-    """
-    def __init__(self, unique_id, pos, model, initial_direction):
-        super().__init__(unique_id, model)
-        self.pos = pos
-        self.directions = []
-        self.directions.append(initial_direction)
-        self.main_direction = initial_direction
-        
-    def add_direction(self, direction):
-        self.directions.append(direction)
-    
-    def set_main_direction(self, direction):
-        self.main_direction = direction
-
-
-class Buildings(mesa.Agent):
-    """
-    A Building Agent. A car can't go through it.
-    """
-    def __init__(self, unique_id, pos, model):
-        super().__init__(unique_id, model)
-        self.pos = pos
-
-
-class ParkingSpots(mesa.Agent):
-    """
-    A ParkingSpot Agent. The start and goal of a car.
-    """
-    def __init__(self, unique_id, pos, number, model):
-        super().__init__(unique_id, model)
-        self.pos = pos
-        self.number = number
-
-
-class RoundAbout(mesa.Agent):
-    """
-    A RoundAbout Agent. A car can't go through it.
-    """
-    def __init__(self, unique_id, pos, model):
-        super().__init__(unique_id, model)
-        self.pos = pos
-
+import search
+from scheduler import TrackedAttribute
 
 class Stoplight(mesa.Agent):
     """
     A Stoplight Agent. Will change color each 10 steps.
+    Its color comes from the model's SignalController, stoplights don't step.
     """
     def __init__(self, unique_id, pos, color, model):
         super().__init__(unique_id, model)
         self.pos = pos
-        self.color = color
-        self.step_counter = 0  # Initialize the step counter
+        self.initial_color = color
         self.type = ""
-        if self.color == "green":
+        if color == "green":
             self.type = "A"
-        elif self.color == "red":
+        elif color == "red":
             self.type = "B"
         else: self.type = "N/A"
-    
-    def step(self):
-        """
-        Changes (maybe) Stoplight's color. Will execute on each step. 
-        """
-        # Increment the step counter in each step
-        self.step_counter += 1
-        
-        # Check if the step number is 2 steps before changing colors
-        if (self.step_counter + 2) % 10 == 0:
-            if self.color == "green":
-                self.color = "yellow"
-            else: 
-                self.color = self.color 
-        # Check if the step number is divisible by 10
-        elif self.step_counter % 10 == 0:
-            # Change color from green to red or from red to green
-            if self.color == "green" or self.color == "yellow":
-                self.color = "red"
-            else:
-                self.color = "green"
-        else: 
-            self.color = self.color
+
+    @property
+    def color(self):
+        signals = getattr(self.model, "signals", None)
+        if signals is None:
+            return self.initial_color
+        return signals.color(self.type)
 
 
 class Car(mesa.Agent):
     """
     A Car agent. 
     """
+    # Whether the car keeps driving on its own, counted by the scheduler's "running" filter
+    running = TrackedAttribute()
+
     def __init__(self, unique_id, pos, model):
         super().__init__(unique_id, model)
+        self.spawn(pos)
 
+    def spawn(self, pos):
+        """
+        Puts the car back in its initial state at 'pos', also used when the model
+        reuses a retired car instead of creating a new one.
+        """
         self.is_active = True
         self.initial_pos = pos
         self.pos = pos
-        self.path = []  # Store the path the car will follow
+        # Cell ids of the path the car will follow, path[path_index] is the next one
+        self.path = ()
+        self.path_index = 0
         self.goal_pos = None  # Store the goal position for the car
         self.moore = False # Moore neighborhood
         self.running = True
         self.current_direction = (0,1)
 
-        this_cell =self.model.grid.get_cell_list_contents(self.pos)
-        for a in this_cell:
-            if isinstance(a,Road):   
-                self.translate_direction(a.main_direction)
+        self.translate_direction(self.model.road_graph.main_direction_at(self.pos))
         
         self.start_spot = None
         self.goal_spot = None
+        self.planner = None  # D* Lite state kept between replans by the incremental routing
+        self.route = []  # Abstract route (start, entrances, goal) of the hierarchical routing
+        self.route_index = 0  # Index in 'route' of the start of the segment the car is on
 
     def translate_direction(self, direction):
         """
@@ -139,30 +85,11 @@ class Car(mesa.Agent):
         """
         Helper function, indicates if the car is allowed to move to cell.
         Takes a pos argument, a tuple of (x,y).
+        Reads the model's cell layers: other cars, buildings, roundabouts and red lights block it.
         """
-        can_move = False
-        if pos == self.pos:
-            return True
-        
-        this_cell =self.model.grid.get_cell_list_contents(pos)
-
-        for a in this_cell:
-            # Check if it is occupied by another car.
-            if isinstance(a, Car) or isinstance(a, Buildings) or isinstance(a, RoundAbout):
-                can_move = False
-        
-            elif isinstance(a, Stoplight): # if it's Stoplight 
-                if a.color == "green" or a.color == "yellow": 
-                    can_move = True 
-                    self.running = True
-                    
-                else: # If it's red
-                    can_move = False
-                    self.running = False
-            else: # If its road
-                can_move = True
-                self.running = True
-        
+        can_move, running = self.model.layers.can_move(pos, self.pos)
+        if running is not None:
+            self.running = running
         return can_move
 
     # TODO: Make them de-spawn when entering a parking spot
@@ -172,60 +99,46 @@ class Car(mesa.Agent):
         Helper function to check if direction to move is available.
         Input: curr = (x,y); next_pos = (x,y);
         """
-        this_cell =self.model.grid.get_cell_list_contents(curr)
-        available_directions = []
-        for a in this_cell:
-            # Check if it is a Road.
-            if isinstance(a, Road):
-                available_directions = a.directions
-            
-        next_direct = ""
         if curr == next_pos:
             return True
-        # y_curr < y_next => N
-        if curr[1] < next_pos[1] and curr[0] == next_pos[0]:
-            next_direct = "N"
-        # y_curr > y_next => S
-        elif curr[1] > next_pos[1] and curr[0] == next_pos[0]:
-            next_direct = "S"
-        # x_curr < x_next => E
-        elif curr[0] < next_pos[0] and curr[1] == next_pos[1]:
-            next_direct = "E"
-        # x_curr > x_next => W
-        elif curr[0] > next_pos[0] and curr[1] == next_pos[1]:
-            next_direct = "W"
-
-        if next_direct in available_directions:
-            return True
-        
-        return False
+        return self.model.layers.direction_is_available(curr, next_pos)
     
     def continue_path(self, position):    
         """
         Helper function that follows the path if there is no AStar path 
         """
-        this_cell =self.model.grid.get_cell_list_contents(position)
+        main_direction = self.model.road_graph.main_direction_at(position)
+        if main_direction is not None:
+            self.translate_direction(main_direction)
+            new_direction = (position[0] + self.current_direction[0],
+                             position[1] + self.current_direction[1]
+                             )
+            if self.can_move_to_cell(new_direction):
+                self.move(new_direction)
         
-        for a in this_cell:
-            if isinstance(a, Road):
-                self.translate_direction(a.main_direction)
-                new_direction = (position[0] + self.current_direction[0],
-                                 position[1] + self.current_direction[1]
-                                 )
-                if self.can_move_to_cell(new_direction):
-                    self.move(new_direction)
-        
-        self.path = self.aStarSearch(self.pos,self.goal_pos)
+        self.set_path(self.plan_path(self.pos,self.goal_pos))
+
+    def set_path(self, path):
+        self.path = path
+        self.path_index = 0
+
+    def has_path(self):
+        return self.path_index < len(self.path)
 
     def remove_car(self):
         self.model.available_spots.append((self.initial_pos[0],self.initial_pos[1],self.start_spot))
         self.model.available_spots.append((self.goal_pos[0],self.goal_pos[1],self.goal_spot))
+        if self.is_active:
+            self.model.retiring.append(self)  # Taken off the grid by the model's check_active
         self.is_active = False
 
     def move(self, pos):
         # Save the previous position
         prev = self.pos
         self.model.grid.move_agent(self, pos)
+        if pos != prev:
+            self.model.car_left(prev)
+            self.model.car_entered(pos)
         direction = (pos[0]-prev[0],pos[1]-prev[1])
         if not direction == (0,0):
             self.current_direction = direction
@@ -246,15 +159,15 @@ class Car(mesa.Agent):
             self.remove_car()
 
         # If it has not got a path in the position and it still has a goal position
-        if not self.path and self.goal_pos:
-            self.path = self.aStarSearch(self.pos, self.goal_pos)
+        if not self.has_path() and self.goal_pos:
+            self.set_path(self.plan_path(self.pos, self.goal_pos))
 
         # Check if the car has a path to follow
-        if self.path:
-            next_pos = self.path[0]
+        if self.has_path():
+            next_pos = self.model.road_graph.cell_pos(self.path[self.path_index])
             if self.can_move_to_cell(next_pos) and self.direction_is_available(self.pos,next_pos):
                 self.move(next_pos)
-                self.path.pop(0)  
+                self.path_index += 1
             else:
                 self.continue_path(self.pos)
                 
@@ -268,54 +181,101 @@ class Car(mesa.Agent):
     ############################# ~ ~ ~ SEARCH METHODS ~ ~ ~ #############################
     """
 
-    def heuristic(self, current, goal):
+    def plan_path(self, start, goal):
         """
-        Calculate the Euclidean distance heuristic with a tie-breaking rule.
+        Plans the cells to follow from 'start' to 'goal' with the model's routing mode.
+        Returns their cell ids, the car only turns the next one into a position.
         """
-        # Check if the cell can be moved to; if not, increase heuristic value significantly
-        if not self.can_move_to_cell(current):
-            heuristic = math.inf  # Increase heuristic significantly if the cell cannot be moved to
-            return heuristic
-            
-        # Euclidean distance as base heuristic
-        heuristic = math.sqrt((goal[0] - current[0]) ** 2 + (goal[1] - current[1]) ** 2)
-
-        return heuristic
-    
-    def reconstruct_path(self, came_from, current):
-        """
-        Reconstructs the path from start to goal using the 'came_from' dictionary.
-        """
-        total_path = [current]
-        while current in came_from:
-            current = came_from[current]
-            total_path.append(current)
-        return total_path[::-1]
-
+        if self.model.routing == "flowfield":
+            return self.flowFieldPath(start, goal)
+        if self.model.routing == "incremental":
+            return self.dStarLiteSearch(start, goal)
+        if self.model.routing == "hierarchical":
+            return self.hierarchicalPath(start, goal)
+        return self.aStarSearch(start, goal)
 
     def aStarSearch(self, start, goal):
         """
         A* search algorithm to find the shortest path from 'start' to 'goal'.
+        Walks the model's compiled road graph, cars and red lights are read from the cell layers.
+        Repeated searches are answered by the model's route cache.
         """
-        frontier = util.PriorityQueue()
-        frontier.push(start, 0)
-        came_from = {}
-        cost_so_far = {start: 0}
-
-        while not frontier.isEmpty():
-            current = frontier.pop()
-
-            if current == goal:
-                return self.reconstruct_path(came_from, goal)
-
-            for next_pos in self.model.grid.get_neighborhood(current, moore=self.moore, include_center=False):
-                # Check if the next position is valid to move to
-                if self.direction_is_available(current,next_pos):
-                    new_cost = cost_so_far[current] + self.heuristic(current, next_pos)
-                    if next_pos not in cost_so_far or new_cost < cost_so_far[next_pos]:
-                        cost_so_far[next_pos] = new_cost
-                        priority = new_cost + self.heuristic(next_pos, goal)
-                        frontier.push(next_pos, priority)
-                        came_from[next_pos] = current
-
-        return []  # If no path found
\ No newline at end of file
+        graph = self.model.road_graph
+        start_cell, goal_cell = graph.cell_id(start), graph.cell_id(goal)
+        path = self.model.route_cache.get(start_cell, goal_cell)
+        if path is None:
+            result = search.a_star(graph, start_cell, goal_cell, self.model.layers.is_blocked,
+                                   self.model.search_heuristic(goal_cell))
+            self.model.search_expansions += result.expanded
+            path = result.path
+            self.model.route_cache.put(start_cell, goal_cell, path, result.generated)
+        return path
+
+
+    def flowFieldPath(self, start, goal):
+        """
+        Reads the next cell towards 'goal' from the goal's precomputed flow field.
+        The car plans one move at a time, each one is a table lookup.
+        """
+        graph = self.model.road_graph
+        field = self.model.flow_fields[goal]
+        next_cell = field.next_cell(graph.cell_id(start))
+        if next_cell < 0:
+            return ()
+        return (next_cell,)
+
+    def dStarLiteSearch(self, start, goal):
+        """
+        Incremental search from 'start' to 'goal'. The car keeps its D* Lite state and
+        only repairs it for the cells that got blocked or freed since the last call.
+        """
+        graph = self.model.road_graph
+        start_cell, goal_cell = graph.cell_id(start), graph.cell_id(goal)
+        if self.planner is None or self.planner.goal != goal_cell:
+            self.planner = search.DStarLite(graph, start_cell, goal_cell, self.model.landmarks)
+        # Only the cells logged since the last call are read again, the whole grid only
+        # for a new planner (or one that fell behind the log)
+        cache = self.model.route_cache
+        changed = cache.changed_since(self.planner.stamp)
+        if changed is None:
+            self.planner.set_blocked(self.model.blocked_cells())
+        else:
+            self.planner.cells_changed(changed, self.model.layers.is_blocked)
+        self.planner.stamp = cache.changes
+        expansions = self.planner.expansions
+        path = self.planner.replan(start_cell)
+        self.model.search_expansions += self.planner.expansions - expansions
+        return path
+
+    def hierarchicalPath(self, start, goal):
+        """
+        HPA* towards 'goal': the car keeps its abstract route through the cluster entrances
+        and only turns the segment it is on into cells. A car pushed off the segment, e.g.
+        around a blocked cell, refines it again from where it is while it stays in the
+        segment's cluster. The route is planned again when the goal changed, the car left
+        that cluster or the segment can't be reached from the car's cell.
+        """
+        graph = self.model.road_graph
+        hierarchy = self.model.hierarchy
+        start_cell, goal_cell = graph.cell_id(start), graph.cell_id(goal)
+        if self.route and self.route[-1] == goal_cell:
+            if start_cell in self.route:
+                self.route_index = self.route.index(start_cell)
+            if self.route_index == len(self.route) - 1:
+                return ()
+            target = self.route[self.route_index + 1]
+            if start_cell in self.route or hierarchy.cluster_of[start_cell] == hierarchy.cluster_of[target]:
+                result = hierarchy.refine(start_cell, target, self.model.layers.is_blocked)
+                self.model.search_expansions += result.expanded
+                if result.path:
+                    return result.path
+
+        result = hierarchy.abstract_path(start_cell, goal_cell)
+        self.model.search_expansions += result.expanded
+        self.route = result.path
+        self.route_index = 0
+        if len(self.route) < 2:
+            return ()
+        result = hierarchy.refine(start_cell, self.route[1], self.model.layers.is_blocked)
+        self.model.search_expansions += result.expanded
+        return result.path
@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Parameters of a run that the sweep can vary, with the StreetView defaults
+DEFAULTS = {"max_cars": 16, "car_limit": 50, "initial_cars": 8, "seed": 0, "layout_dir": "."}
+
+
+def make_grid(max_cars, car_limit, initial_cars, seeds, layout_dirs):
+    """
+    Returns the parameters of every run of the sweep, one dict per combination.
+    """
+    runs = []
+    for layout_dir, max_cars_, car_limit_, initial, seed in itertools.product(
+            layout_dirs, max_cars, car_limit, initial_cars, seeds):
+        runs.append({"max_cars": max_cars_, "car_limit": car_limit_, "initial_cars": initial,
+                     "seed": seed, "layout_dir": os.path.abspath(layout_dir)})
+    return runs
+
+
+def run_key(params):
+    """
+    Identifies a run in the results file, the same parameters always give the same key.
+    """
+    return json.dumps(params, sort_keys=True)
+
+
+def completed_runs(path):
+    """
+    Returns the keys of the runs already written to the results file at 'path'.
+    Runs that failed are not in it, so they are tried again.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Line cut short by an interrupted run
+            if "error" not in record:
+                done.add(run_key(record["params"]))
+    return done
+
+
+def run_simulation(params, steps, routing="astar"):
+    """
+    Runs one StreetView headless for up to 'steps' steps, or until every car it may
+    spawn reached its goal, and returns the summary metrics of the run.
+    """
+    from model import StreetView
+
+    start = time.perf_counter()
+    # The model prints every spawn, keep the workers quiet
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        model = StreetView(routing=routing, max_cars=params["max_cars"],
+                           initial_cars=params["initial_cars"], car_limit=params["car_limit"],
+                           layout_dir=params["layout_dir"], seed=params["seed"])
+        built = time.perf_counter()
+        active_total = 0
+        expansions = 0
+        for _ in range(steps):
+            model.step()
+            active_total += model.active_cars
+            expansions += model.search_expansions
+            if model.finished_cars >= model.car_limit and model.active_cars == 0:
+                break
+    end = time.perf_counter()
+
+    return {"steps": model.step_count,
+            "build_seconds": built - start,
+            "run_seconds": end - built,
+            "steps_per_second": model.step_count / (end - built) if end > built else 0.0,
+            "spawned": model.finished_cars,
+            "arrived": model.finished_cars - model.active_cars,
+            "active": model.active_cars,
+            "mean_active": active_total / model.step_count if model.step_count else 0.0,
+            "search_expansions": expansions,
+            "route_cache": model.route_cache.stats()}
+
+
+def _run(params, steps, routing):
+    try:
+        return {"params": params, "metrics": run_simulation(params, steps, routing)}
+    except Exception as error:
+        return {"params": params, "error": f"{type(error).__name__}: {error}"}
+
+
+def run_batch(runs, out, steps=500, routing="astar", workers=None, resume=True):
+    """
+    Runs every parameter dict of 'runs' across a pool of 'workers' processes (one per
+    core by default). Each result is appended to the JSON lines file 'out' as soon as
+    its run finishes, so an interrupted batch loses only the runs in flight. With
+    'resume' the runs already in 'out' are skipped. 'steps' and 'routing' are recorded
+    with the parameters of each run, so a batch with other values doesn't skip them.
+    Returns the number of runs done.
+    """
+    runs = [dict(params, steps=steps, routing=routing) for params in runs]
+    done = completed_runs(out) if resume else set()
+    pending = [params for params in runs if run_key(params) not in done]
+    finished = 0
+    with open(out, "a" if resume else "w") as file, \
+            ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(_run, params, steps, routing) for params in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+            finished += 1
+            status = record.get("error") or f"{record['metrics']['steps']} steps"
+            print(f"[{finished}/{len(pending)}] {run_key(record['params'])}: {status}", file=sys.stderr)
+    return finished
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless parameter sweeps over StreetView.")
+    parser.add_argument("--max-cars", type=int, nargs="+", default=[DEFAULTS["max_cars"]])
+    parser.add_argument("--car-limit", type=int, nargs="+", default=[DEFAULTS["car_limit"]])
+    parser.add_argument("--initial-cars", type=int, nargs="+", default=[DEFAULTS["initial_cars"]])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[DEFAULTS["seed"]])
+    parser.add_argument("--replicas", type=int, default=None,
+                        help="use seeds 0..N-1 instead of --seeds")
+    parser.add_argument("--layouts", nargs="+", default=[DEFAULTS["layout_dir"]],
+                        help="directories holding layout.txt, flowN/S/E/W.txt and mainFlow.txt")
+    parser.add_argument("--steps", type=int, default=500, help="most steps of each run")
+    parser.add_argument("--routing", default="astar")
+    parser.add_argument("--workers", type=int, default=None, help="processes, one per core by default")
+    parser.add_argument("--out", default="batch_results.jsonl")
+    parser.add_argument("--restart", action="store_true", help="overwrite --out instead of resuming it")
+    args = parser.parse_args()
+
+    seeds = list(range(args.replicas)) if args.replicas else args.seeds
+    runs = make_grid(args.max_cars, args.car_limit, args.initial_cars, seeds, args.layouts)
+    finished = run_batch(runs, args.out, args.steps, args.routing, args.workers, not args.restart)
+    print(f"{finished} of {len(runs)} runs written to {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import contextlib
+from model import StreetView
+from agents import Car
+
+# Seed of every benchmarked model, so each run measures the same trajectory
+SEED = 1
+# Fleet sizes of the steps/sec benchmark
+FLEET_SIZES = (8, 16, 32)
+
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Silences the model's prints (one per spawned car) while timing it.
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def timed(function, repeat):
+    """
+    Calls 'function' 'repeat' times and returns the median wall time of a call in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def result(value, unit, higher_is_better=False):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def bench_construction(repeat):
+    with quiet():
+        seconds = timed(lambda: StreetView(seed=SEED), repeat)
+    return {"construction": result(seconds * 1e3, "ms")}
+
+
+def bench_steps(steps, repeat):
+    """
+    Steps/sec of the model with each of FLEET_SIZES cars on the map.
+    """
+    results = {}
+    for cars in FLEET_SIZES:
+        def run():
+            model = StreetView(seed=SEED, max_cars=cars, initial_cars=cars, car_limit=10 ** 9)
+            start = time.perf_counter()
+            for _ in range(steps):
+                model.step()
+            return time.perf_counter() - start
+        with quiet():
+            seconds = statistics.median(run() for _ in range(repeat))
+        results[f"steps_per_second[cars={cars}]"] = result(steps / seconds, "steps/s", True)
+    return results
+
+
+def bench_search(steps, repeat):
+    """
+    Latency and node expansions of Car.aStarSearch between every pair of parking spots,
+    on a model run 'steps' steps so the search sees cars and red lights. The route
+    cache is off so every call searches.
+    """
+    with quiet():
+        model = StreetView(seed=SEED, route_cache_size=0)
+        for _ in range(steps):
+            model.step()
+    car = next(iter(model.schedule.agents_by_type[Car].values()))
+    spots = [(x, y) for x, y, _ in model.parkingSpots_positions]
+    pairs = [(start, goal) for start in spots for goal in spots if start != goal]
+
+    def search_all():
+        for start, goal in pairs:
+            car.aStarSearch(start, goal)
+
+    model.search_expansions = 0
+    search_all()
+    expansions = model.search_expansions / len(pairs)
+    seconds = timed(search_all, repeat) / len(pairs)
+    return {"astar_latency": result(seconds * 1e6, "us"),
+            "astar_expansions": result(expansions, "nodes")}
+
+
+def bench_serialization(steps, repeat):
+    """
+    Time to build the frames of get_info: full JSON, delta JSON and binary.
+    """
+    with quiet():
+        model = StreetView(seed=SEED)
+        for _ in range(steps):
+            model.step()
+    since = model.step_count - 1
+    count = 1000
+    return {"get_info_json": result(timed(lambda: [model.get_info() for _ in range(count)], repeat) / count * 1e6, "us"),
+            "get_info_delta": result(timed(lambda: [model.get_info(since) for _ in range(count)], repeat) / count * 1e6, "us"),
+            "get_frame_bytes": result(timed(lambda: [model.get_frame_bytes() for _ in range(count)], repeat) / count * 1e6, "us")}
+
+
+def bench_flask(repeat):
+    """
+    Latency of /getPositions through the Flask test client, one step per POST.
+    """
+    import flaskServer
+    flaskServer.configure(model_kwargs={"seed": SEED})
+    client = flaskServer.app.test_client()
+    headers = {"X-Session-ID": "benchmark"}
+    count = 100
+    with quiet():
+        client.get("/getPositions", headers=headers)  # Creates the session
+        post = timed(lambda: [client.post("/getPositions", headers=headers) for _ in range(count)], repeat)
+        get = timed(lambda: [client.get("/getPositions", headers=headers) for _ in range(count)], repeat)
+    flaskServer.sessions.shutdown()
+    return {"flask_post_getPositions": result(post / count * 1e6, "us"),
+            "flask_get_getPositions": result(get / count * 1e6, "us")}
+
+
+def run_benchmarks(steps=200, repeat=5, flask=True):
+    """
+    Runs the whole suite, returns {"meta": {...}, "results": {name: {"value", "unit", "higher_is_better"}}}.
+    """
+    results = {}
+    results.update(bench_construction(repeat))
+    results.update(bench_steps(steps, repeat))
+    results.update(bench_search(steps, repeat))
+    results.update(bench_serialization(steps, repeat))
+    if flask:
+        results.update(bench_flask(repeat))
+    meta = {"python": platform.python_version(), "platform": platform.platform(),
+            "steps": steps, "repeat": repeat, "seed": SEED, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    return {"meta": meta, "results": results}
+
+
+def compare(current, baseline, threshold):
+    """
+    Returns the regressions of 'current' against 'baseline': the benchmarks that got worse
+    by more than 'threshold' (a fraction, 0.1 is 10%), as (name, baseline, current, change).
+    Benchmarks missing from either side are ignored.
+    """
+    regressions = []
+    for name, new in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None or not old["value"]:
+            continue
+        change = (new["value"] - old["value"]) / old["value"]
+        if new["higher_is_better"]:
+            change = -change
+        if change > threshold:
+            regressions.append((name, old["value"], new["value"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks of the street simulation.")
+    parser.add_argument("--steps", type=int, default=200, help="steps of each simulated run")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions, the median is kept")
+    parser.add_argument("--no-flask", action="store_true", help="skip the Flask route benchmarks")
+    parser.add_argument("--out", default="benchmark_results.json", help="where to write the results")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fraction a benchmark may get worse than the baseline before it counts as a regression")
+    parser.add_argument("--save-baseline", help="also write the results to this file, to compare later runs against")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.steps, args.repeat, not args.no_flask)
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, "w") as file:
+            json.dump(current, file, indent=2)
+    for name, entry in current["results"].items():
+        print(f"{name:40} {entry['value']:12.3f} {entry['unit']}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(current, baseline, args.threshold)
+        for name, old, new, change in regressions:
+            print(f"REGRESSION {name}: {old:.3f} -> {new:.3f} ({change:+.1%} worse)", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
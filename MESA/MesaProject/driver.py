@@ -0,0 +1,99 @@
+import threading
+import time
+import traceback
+
+
+class FrameFeed:
+    """
+    Latest published frame of a model, with a way to wait for the next one.
+
+    Readers that fall behind just get the newest frame when they come back, frames
+    published in between are skipped rather than queued for them.
+    """
+    def __init__(self, frame):
+        self.frame = frame
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def publish(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def wait_for_frame(self, after_step, timeout=None):
+        """
+        Blocks until a frame newer than 'after_step' is published, returns the latest
+        frame (which may still be the old one if 'timeout' runs out or the feed closes).
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame.step > after_step or self.closed, timeout)
+            return self.frame
+
+
+class SimulationDriver:
+    """
+    Steps a model on a background thread and publishes the latest finished frame.
+
+    'tick_rate' is the target number of steps per second, None or 0 runs as fast as
+    possible. Anything else that touches the model must hold 'lock'. Readers get the
+    published frame from 'feed' without waiting for a step. If a step raises, the driver
+    stops, keeps the error in 'error' and closes the feed.
+    """
+    def __init__(self, model, tick_rate=None, lock=None, feed=None):
+        self.model = model
+        self.period = 1.0 / tick_rate if tick_rate else 0.0
+        self.lock = lock or threading.Lock()
+        self.feed = feed or FrameFeed(model.latest_frame())
+        self.ticks = 0
+        self.error = None  # Exception that stopped the driver, if any
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name="simulation-driver", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def frame(self):
+        return self.feed.frame
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                with self.lock:
+                    self.model.step()
+                    frame = self.model.latest_frame()
+            except Exception as error:
+                traceback.print_exc()
+                self.error = error
+                self.feed.close()  # Ends the streams of the session
+                return
+            self.feed.publish(frame)
+            self.ticks += 1
+
+            if self.period:
+                next_tick += self.period
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    self._stop.wait(delay)
+                else:
+                    next_tick = time.monotonic()  # Running late, don't try to catch up
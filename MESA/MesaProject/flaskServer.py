@@ -1,19 +1,218 @@
 import json 
-from model import StreetView
-from flask import Flask, request
+import argparse
+from sessions import SessionManager, SessionLimitError, SESSION_ID
+from flask import Flask, request, Response
 app = Flask(__name__)
 
-streets = StreetView()
+# Most steps a single batch request may advance
+MAX_BATCH_STEPS = 10000
+# Seconds a stream waits for a new frame before sending a keep-alive comment
+STREAM_KEEPALIVE = 15
+# Session of the clients that don't name one
+DEFAULT_SESSION = "default"
+
+# One StreetView per client session, created on their first request
+sessions = SessionManager()
+
+def configure(**kwargs):
+    """
+    Replaces the session manager, see SessionManager for the options.
+    """
+    global sessions
+    sessions.shutdown()
+    sessions = SessionManager(**kwargs)
+    return sessions
+
+def current_session():
+    """
+    Session named by the X-Session-ID header or the ?session= parameter, the shared
+    default one if neither is given. Returns (session, None) or (None, error response).
+    """
+    session_id = request.headers.get('X-Session-ID') or request.args.get('session', DEFAULT_SESSION)
+    if not SESSION_ID.match(session_id):
+        return None, ({"error": "session ids are 1 to 64 letters, digits, '-' or '_'"}, 400)
+    try:
+        return sessions.get(session_id), None
+    except SessionLimitError as error:
+        return None, ({"error": str(error)}, 503)
+
+def driver_error(session):
+    """
+    Error response if the session's background driver stopped on a failed step, else None.
+    The session keeps its last frame but won't advance, DELETE /session starts it over.
+    """
+    driver = session.driver
+    if driver is None or driver.is_running():
+        return None
+    return {"error": f"the simulation stopped: {type(driver.error).__name__}: {driver.error}"}, 500
+
+def wants_binary():
+    """
+    Whether the client asked for binary frames, with ?format=binary or an
+    Accept: application/octet-stream header. JSON stays the default.
+    """
+    if request.args.get('format') == 'binary':
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', 'application/octet-stream'])
+    return best == 'application/octet-stream'
+
+def frame_response(session, since):
+    if since is None:
+        # Latest published frame, no need to wait for the model
+        frame = session.feed.frame
+        if wants_binary():
+            return Response(frame.to_bytes(), mimetype='application/octet-stream')
+        return frame.to_json()
+    return session.get_info(since)
+
+def batch_response(session, steps, stride):
+    """
+    Advances the model 'steps' steps in one request and returns every 'stride'-th frame:
+    {"frames": [...]} as JSON, or the binary frames one after the other.
+    """
+    binary = wants_binary()
+    frames = session.run_steps(steps, stride, binary)
+    if binary:
+        return Response(b"".join(frames), mimetype='application/octet-stream')
+    return json.dumps({"frames": frames})
 
 @app.route('/getPositions', methods = ['POST', 'GET'])
 def getPositions():
+    session, error = current_session()
+    if error:
+        return error
+    stopped = driver_error(session)
+    if stopped:
+        return stopped
+    # Last step the client acknowledged, to only get what changed since (delta frames)
+    since = request.args.get('since', type=int)
     if request.method == 'POST':
-        streets.step()
-        info = streets.get_info()
+        # Fast-forward: ?steps=N advances N steps at once, ?stride=K keeps every K-th frame
+        steps = request.args.get('steps', default=1, type=int)
+        stride = request.args.get('stride', default=1, type=int)
+        if steps < 1 or stride < 1 or steps > MAX_BATCH_STEPS:
+            return {"error": f"steps must be in 1..{MAX_BATCH_STEPS} and stride at least 1"}, 400
+        if session.driver is not None:
+            # The background driver advances the model, a POST just reads like a GET
+            if steps > 1 or stride > 1:
+                return {"error": "batch steps are not available while the simulation runs in the background"}, 409
+            return frame_response(session, since)
+        if steps > 1 or stride > 1:
+            return batch_response(session, steps, stride)
+        session.step()
+        info = frame_response(session, since)
         return info
     elif request.method == 'GET':
-        info = streets.get_info()
+        info = frame_response(session, since)
         return info
 
+@app.route('/session', methods = ['DELETE'])
+def endSession():
+    """
+    Ends the caller's session now instead of waiting for it to go idle.
+    """
+    session_id = request.headers.get('X-Session-ID') or request.args.get('session', DEFAULT_SESSION)
+    if not sessions.close(session_id):
+        return {"error": "no such session"}, 404
+    return {"closed": session_id}
+
+@app.route('/sessions', methods = ['GET'])
+def sessionStats():
+    return sessions.stats()
+
+@app.route('/metrics', methods = ['GET', 'POST'])
+def metrics():
+    """
+    GET: per-phase step timing of the session (percentiles in ms) and its route cache stats.
+    POST: ?enabled=true|false turns the timing on or off, ?profile=N captures a cProfile
+    of the next N steps, read it back from /metrics/profile.
+    """
+    session, error = current_session()
+    if error:
+        return error
+    if request.method == 'POST':
+        enabled = request.args.get('enabled')
+        if enabled is not None:
+            enabled = enabled.lower() in ('1', 'true', 'on', 'yes')
+        profile_steps = request.args.get('profile', type=int)
+        if profile_steps is not None and profile_steps < 1:
+            return {"error": "profile must be at least 1 step"}, 400
+        session.configure_metrics(enabled, profile_steps)
+    return session.metrics()
+
+@app.route('/metrics/profile', methods = ['GET'])
+def profileReport():
+    session, error = current_session()
+    if error:
+        return error
+    report = session.profile_report()
+    if report is None:
+        return {"error": "no profile captured yet, POST /metrics?profile=N first"}, 404
+    return Response(report, mimetype='text/plain')
+
+def stream_frames(session, after_step, limit=None):
+    """
+    Server-Sent Events of every frame newer than 'after_step', as they get published.
+
+    Each client only ever waits for the latest frame: while it is slow to read, the
+    write back to it blocks this generator and the frames published in the meantime
+    are skipped, the next event it gets is the newest one. The 'id' of an event is
+    its step, so the gap tells the client how many frames it missed. The stream ends
+    when the session does.
+    """
+    feed = session.feed
+    sent = 0
+    while limit is None or sent < limit:
+        frame = feed.wait_for_frame(after_step, STREAM_KEEPALIVE)
+        if feed.closed:
+            return
+        if frame.step <= after_step:
+            yield ": keep-alive\n\n"
+            continue
+        # An open stream counts as use, its session isn't idle
+        session.touch()
+        yield f"id: {frame.step}\nevent: frame\ndata: {frame.to_json()}\n\n"
+        after_step = frame.step
+        sent += 1
+
+@app.route('/streamPositions', methods = ['GET'])
+def streamPositions():
+    session, error = current_session()
+    if error:
+        return error
+    stopped = driver_error(session)
+    if stopped:
+        return stopped
+    # Reconnecting EventSource clients send the last step they got, resume after it.
+    # Without it the stream starts with the current frame
+    after_step = request.headers.get('Last-Event-ID', type=int)
+    if after_step is None:
+        after_step = request.args.get('since', default=session.feed.frame.step - 1, type=int)
+    # ?limit=N closes the stream after N frames, handy for scripts and local testing
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return {"error": "limit must be at least 1"}, 400
+    return Response(stream_frames(session, after_step, limit), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 if __name__ == '__main__':
-    app.run(debug=True,port=8000)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Flask server of the street simulation.")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--background', action='store_true',
+                        help="step each session's model on a background thread instead of on each POST")
+    parser.add_argument('--tick-rate', type=float, default=0,
+                        help="steps per second of the background threads, 0 runs as fast as possible")
+    parser.add_argument('--max-sessions', type=int, default=16,
+                        help="most sessions alive at once, idle ones are evicted to make room")
+    parser.add_argument('--idle-timeout', type=float, default=600,
+                        help="seconds without requests after which a session may be evicted")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="run the session models in this many worker processes, 0 keeps them in the server")
+    args = parser.parse_args()
+    if args.background and args.workers:
+        parser.error("--background can't be combined with --workers")
+    configure(max_sessions=args.max_sessions, idle_timeout=args.idle_timeout, workers=args.workers,
+              background=args.background, tick_rate=args.tick_rate)
+    sessions.start_reaper()
+    # The reloader would start a second process with its own drivers and workers
+    app.run(debug=True, port=args.port, use_reloader=not (args.background or args.workers))
@@ -0,0 +1,123 @@
+import json
+import struct
+from collections import OrderedDict
+import numpy as np
+
+
+def car_json(car_id, state):
+    """
+    JSON record of a car, the format Unity reads: {car_id, position {x, z}, current_direction {x, z}}.
+    """
+    x, z, dx, dz = state
+    return {"car_id": car_id,
+            "position": {"x": x, "z": z},
+            "current_direction": {"x": dx, "z": dz}}
+
+
+class FrameHistory:
+    """
+    Car states of the last steps of a model, {car_id: (x, z, direction x, direction z)}
+    per step, to send clients only what changed since the step they acknowledged.
+
+    A client gets a full keyframe instead of a delta when its step is no longer kept,
+    or when a keyframe boundary (every 'keyframe_interval' steps) was crossed since then,
+    so every client resyncs at least once per interval.
+    """
+    def __init__(self, keyframe_interval=50):
+        self.keyframe_interval = keyframe_interval
+        self.frames = OrderedDict()
+
+    def record(self, step, cars):
+        self.frames[step] = cars
+        while len(self.frames) > self.keyframe_interval + 1:
+            self.frames.popitem(last=False)
+
+    def needs_keyframe(self, since, step):
+        if since not in self.frames or since > step:
+            return True
+        return since // self.keyframe_interval != step // self.keyframe_interval
+
+    def delta(self, since, step):
+        """
+        Returns (added, changed, removed) between the frames of steps 'since' and 'step':
+        JSON records of the new and changed cars and the ids of the removed ones.
+        """
+        old, new = self.frames[since], self.frames[step]
+        added = []
+        changed = []
+        for car_id, state in new.items():
+            previous = old.get(car_id)
+            if previous is None:
+                added.append(car_json(car_id, state))
+            elif previous != state:
+                changed.append(car_json(car_id, state))
+        removed = [car_id for car_id in old if car_id not in new]
+        return added, changed, removed
+
+
+# Binary frames: a header, one record per stoplight group and one record per car,
+# all little-endian and fixed width so clients can read them without parsing.
+BINARY_MAGIC = b"SVF1"
+HEADER = struct.Struct("<4sIIHH")  # magic, step, car count, stoplight count, reserved
+STOPLIGHT_DTYPE = np.dtype([("stop_type", "u1"), ("color", "u1")])
+CAR_DTYPE = np.dtype([("car_id", "<u4"), ("x", "<i2"), ("z", "<i2"), ("dx", "i1"), ("dz", "i1")])
+STOP_TYPES = ("A", "B", "N/A")
+COLORS = ("green", "yellow", "red")
+
+
+def encode_binary(step, cars, stoplights):
+    """
+    Packs a frame: HEADER, then STOPLIGHT_DTYPE records (indices into STOP_TYPES and
+    COLORS), then CAR_DTYPE records (10 bytes each).
+    'cars' is {car_id: (x, z, dx, dz)}, 'stoplights' the list of get_info's stoplight dicts.
+    """
+    lights = np.array([(STOP_TYPES.index(s["stop_type"]), COLORS.index(s["color"])) for s in stoplights],
+                      dtype=STOPLIGHT_DTYPE)
+    records = np.array([(car_id,) + state for car_id, state in cars.items()], dtype=CAR_DTYPE)
+    header = HEADER.pack(BINARY_MAGIC, step, len(records), len(lights), 0)
+    return header + lights.tobytes() + records.tobytes()
+
+
+def decode_binary(data):
+    """
+    Unpacks a frame made by encode_binary into the same dict get_info would give, plus "step".
+    """
+    magic, step, car_count, stoplight_count, _ = HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Not a binary frame")
+    offset = HEADER.size
+    lights = np.frombuffer(data, dtype=STOPLIGHT_DTYPE, count=stoplight_count, offset=offset)
+    offset += lights.nbytes
+    records = np.frombuffer(data, dtype=CAR_DTYPE, count=car_count, offset=offset)
+    return {"step": step,
+            "cars": [car_json(int(r["car_id"]), (int(r["x"]), int(r["z"]), int(r["dx"]), int(r["dz"])))
+                     for r in records],
+            "stoplights": [{"stop_type": STOP_TYPES[l["stop_type"]], "color": COLORS[l["color"]]}
+                           for l in lights]}
+
+
+class Frame:
+    """
+    A finished step of a model, serialized on demand and at most once per format.
+    'cars' is {car_id: (x, z, dx, dz)} and must not change afterwards.
+    """
+    def __init__(self, step, cars, stoplights):
+        self.step = step
+        self.cars = cars
+        self.stoplights = stoplights
+        self._json = None
+        self._bytes = None
+
+    def to_json(self):
+        """
+        Same JSON as StreetView.get_info() without 'since'.
+        """
+        if self._json is None:
+            self._json = json.dumps({"cars": [car_json(car_id, state) for car_id, state in self.cars.items()],
+                                     "stoplights": self.stoplights})
+        return self._json
+
+    def to_bytes(self):
+        if self._bytes is None:
+            self._bytes = encode_binary(self.step, self.cars, self.stoplights)
+        return self._bytes
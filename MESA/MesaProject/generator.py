@@ -0,0 +1,171 @@
+import os
+import argparse
+import numpy as np
+from roadgraph import DIRECTIONS, DIRECTION_BITS, DIRECTION_OFFSETS
+from layers import ROAD, BUILDING, PARKING, STOPLIGHT, NO_SIGNAL, GREEN, RED
+from layout import Layout, MAP_FILES, MAIN_FLOW_FILE
+
+
+def street_starts(size, block):
+    """
+    First row (or column) of every street across a side of 'size' cells, each street two
+    lanes wide and about 'block' cells apart. The first and last streets run along the edges.
+    """
+    streets = max(1, (size - 2) // (block + 2))
+    return [round(i * (size - 2) / streets) for i in range(streets + 1)]
+
+
+def generate_layout(width, height, block=8, parking_density=0.1, signals=True, seed=None):
+    """
+    Generates a city of 'width' x 'height' cells as a Layout: a grid of two-lane streets
+    around blocks of buildings.
+
+    Vertical streets have a southbound lane then a northbound one, horizontal streets an
+    eastbound lane then a westbound one (from the bottom), so cars can go around every
+    block and turn at every intersection. With 'signals' every lane entering an
+    intersection gets a stoplight: green first (group A) on the horizontal streets, red
+    first (group B) on the vertical ones. 'parking_density' is the share of the building
+    cells next to a lane that become parking spots, at least two of them always do.
+    Raises ValueError if the layout has no room for two spots.
+    """
+    if width < 5 or height < 5:
+        raise ValueError("A layout needs at least 5x5 cells")
+    rng = np.random.default_rng(seed)
+    columns = street_starts(width, block)
+    rows = street_starts(height, block)
+
+    vertical = np.zeros(width, dtype=bool)
+    horizontal = np.zeros(height, dtype=bool)
+    v_lane = np.full(width, -1, dtype=np.int8)  # Lane direction of the street columns
+    h_lane = np.full(height, -1, dtype=np.int8)  # Lane direction of the street rows
+    for c in columns:
+        vertical[c:c + 2] = True
+        v_lane[c], v_lane[c + 1] = DIRECTIONS.index("S"), DIRECTIONS.index("N")
+    for r in rows:
+        horizontal[r:r + 2] = True
+        h_lane[r], h_lane[r + 1] = DIRECTIONS.index("E"), DIRECTIONS.index("W")
+
+    on_vertical = np.broadcast_to(vertical[:, None], (width, height))
+    on_horizontal = np.broadcast_to(horizontal[None, :], (width, height))
+    road = on_vertical | on_horizontal
+    bits = np.array([DIRECTION_BITS[d] for d in DIRECTIONS], dtype=np.uint8)
+    directions = np.zeros((width, height), dtype=np.uint8)
+    directions |= np.where(on_vertical, bits[v_lane][:, None], 0).astype(np.uint8)
+    directions |= np.where(on_horizontal, bits[h_lane][None, :], 0).astype(np.uint8)
+
+    # Main flow along the lane, at intersections the horizontal one unless it leaves the map
+    main_direction = np.full((width, height), -1, dtype=np.int8)
+    main_direction[on_vertical] = np.broadcast_to(v_lane[:, None], (width, height))[on_vertical]
+    main_direction[on_horizontal] = np.broadcast_to(h_lane[None, :], (width, height))[on_horizontal]
+    leaves = np.zeros((width, height), dtype=bool)
+    leaves[0, :] = main_direction[0, :] == DIRECTIONS.index("W")
+    leaves[-1, :] = main_direction[-1, :] == DIRECTIONS.index("E")
+    leaves &= on_vertical
+    main_direction[leaves] = np.broadcast_to(v_lane[:, None], (width, height))[leaves]
+
+    terrain = np.where(road, ROAD, BUILDING).astype(np.int8)
+    signal = np.full((width, height), NO_SIGNAL, dtype=np.int8)
+    if signals:
+        for c in columns:
+            for r in rows:
+                # The lane cell just before the intersection, for each lane entering it
+                for (x, y), color in (((c - 1, r), GREEN), ((c + 2, r + 1), GREEN),
+                                      ((c, r + 2), RED), ((c + 1, r - 1), RED)):
+                    if 0 <= x < width and 0 <= y < height and not (vertical[x] and horizontal[y]):
+                        signal[x, y] = color
+                        terrain[x, y] = STOPLIGHT
+
+    # Parking spots: building cells next to a plain lane cell, entered from and left to it
+    spot = np.full((width, height), -1, dtype=np.int32)
+    plain_lane = (terrain == ROAD) & ~(on_vertical & on_horizontal)
+    towards = np.full((width, height), -1, dtype=np.int8)  # Direction of the lane, first in DIRECTIONS
+    for index in reversed(range(len(DIRECTIONS))):
+        dx, dy = DIRECTION_OFFSETS[DIRECTIONS[index]]
+        next_to_lane = np.zeros((width, height), dtype=bool)
+        next_to_lane[max(0, -dx):width - max(0, dx), max(0, -dy):height - max(0, dy)] = \
+            plain_lane[max(0, dx):width + min(0, dx), max(0, dy):height + min(0, dy)]
+        towards[next_to_lane & (terrain == BUILDING)] = index
+    xs, ys = np.nonzero(towards >= 0)
+    order = np.lexsort((xs, ys))  # Row by row from the bottom, like the layout files
+    candidates = [(x, y, DIRECTIONS[towards[x, y]]) for x, y in zip(xs[order].tolist(), ys[order].tolist())]
+    if len(candidates) < 2:
+        raise ValueError(f"A {width}x{height} layout with blocks of {block} has room for "
+                         f"{len(candidates)} parking spots, cars need at least 2")
+    keep = rng.random(len(candidates)) < parking_density
+    chosen = [candidate for candidate, kept in zip(candidates, keep) if kept]
+    if len(chosen) < 2:
+        chosen = candidates[:2]
+    opposite = {"N": "S", "S": "N", "E": "W", "W": "E"}
+    for number, (x, y, direction) in enumerate(chosen, start=1):
+        dx, dy = DIRECTION_OFFSETS[direction]
+        terrain[x, y] = PARKING
+        spot[x, y] = number
+        directions[x, y] |= DIRECTION_BITS[direction]
+        main_direction[x, y] = DIRECTIONS.index(direction)
+        directions[x + dx, y + dy] |= DIRECTION_BITS[opposite[direction]]
+
+    return Layout(terrain, directions, main_direction, spot, signal)
+
+
+def layout_cells(layout):
+    """
+    Returns the cells of the layout files as {file name: [[cell, ...] per row, top row first]}.
+    """
+    width, height = layout.width, layout.height
+    cells = {}
+    grid = np.full((width, height), "-", dtype=object)
+    grid[layout.terrain == BUILDING] = "%"
+    grid[layout.signal == GREEN] = "G"
+    grid[layout.signal == RED] = "R"
+    parking = layout.spot >= 0
+    grid[parking] = layout.spot[parking].astype(str).astype(object)
+    cells[MAP_FILES[0]] = grid
+    for name, direction in zip(MAP_FILES[1:], ("N", "S", "E", "W")):
+        grid = np.full((width, height), "-", dtype=object)
+        grid[(layout.directions & DIRECTION_BITS[direction]) != 0] = direction
+        cells[name] = grid
+    grid = np.full((width, height), "-", dtype=object)
+    for index, direction in enumerate(DIRECTIONS):
+        grid[layout.main_direction == index] = direction
+    cells[MAIN_FLOW_FILE] = grid
+    return {name: [list(grid[:, y]) for y in range(height - 1, -1, -1)] for name, grid in cells.items()}
+
+
+def write_layout(layout, directory):
+    """
+    Writes 'layout' as the layout.txt, flowN/S/E/W.txt and mainFlow.txt files of 'directory'.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, rows in layout_cells(layout).items():
+        with open(os.path.join(directory, name), "w") as file:
+            file.write("\n".join(",".join(row) for row in rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates city layouts of any size for StreetView.")
+    parser.add_argument("width", type=int)
+    parser.add_argument("height", type=int)
+    parser.add_argument("--block", type=int, default=8, help="cells between two streets")
+    parser.add_argument("--parking-density", type=float, default=0.1,
+                        help="share of the building cells along the streets that become parking spots")
+    parser.add_argument("--no-signals", action="store_true", help="leave the intersections without stoplights")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", default=None, help="directory to write the layout files to")
+    parser.add_argument("--compiled", default=None,
+                        help="also (or only) save the compiled layout, load it with StreetView(layout=path)")
+    args = parser.parse_args()
+    if args.out is None and args.compiled is None:
+        parser.error("give --out, --compiled or both")
+
+    layout = generate_layout(args.width, args.height, args.block, args.parking_density,
+                             not args.no_signals, args.seed)
+    if args.out:
+        write_layout(layout, args.out)
+    if args.compiled:
+        layout.save(args.compiled)
+    print(f"{args.width}x{args.height}: {int((layout.spot >= 0).sum())} parking spots, "
+          f"{int((layout.signal != NO_SIGNAL).sum())} stoplights")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import math
+import heapq
+import numpy as np
+from search import SearchResult, BLOCKED_PENALTY
+
+
+class HierarchicalPlanner:
+    """
+    HPA* (hierarchical path-finding A*) over a RoadGraph.
+
+    The grid is cut into square clusters of 'cluster_size' cells. Every edge of the road
+    graph that leaves a cluster is a transition, its two cells are the entrances of their
+    clusters. The abstract graph links the entrances: transitions cost their edge, and two
+    entrances of the same cluster are linked by the static distance between them inside
+    the cluster, computed the first time a route goes through the cluster and kept until
+    the layout changes there.
+
+    A trip is planned on the abstract graph first (abstract_path), then each segment is
+    turned into cells only when the car gets to it (refine), so the cost of a plan grows
+    with the number of clusters crossed and not with the area of the map.
+    """
+    def __init__(self, graph, cluster_size=16):
+        if cluster_size < 1:
+            raise ValueError(f"Clusters need at least one cell, got {cluster_size}")
+        self.cluster_size = cluster_size
+        self.intra = {}  # cluster -> {entrance: {other entrance: distance}}
+        self.update(graph)
+
+    def cluster_of_cells(self, graph):
+        xs, ys = np.divmod(np.arange(graph.size, dtype=np.int64), graph.height)
+        rows = -(-graph.height // self.cluster_size)
+        return (xs // self.cluster_size) * rows + ys // self.cluster_size
+
+    def update(self, graph, cells=None):
+        """
+        Switches to 'graph', the road graph of a changed layout. Only the clusters holding
+        one of the changed 'cells', or whose entrances changed, are computed again.
+        Without 'cells' every cluster is.
+        """
+        self.graph = graph
+        cluster_of = self.cluster_of_cells(graph)
+        sources = np.repeat(np.arange(graph.size, dtype=np.int64), np.diff(graph.indptr))
+        crossing = (cluster_of[sources] != cluster_of[graph.indices]) & np.isfinite(graph.costs)
+        inter = {}  # entrance -> [(entrance of another cluster, cost), ...]
+        for source, target, cost in zip(sources[crossing].tolist(), graph.indices[crossing].tolist(),
+                                        graph.costs[crossing].tolist()):
+            inter.setdefault(source, []).append((target, cost))
+        entrances = {}  # cluster -> set of its entrances
+        cluster_list = cluster_of.tolist()
+        for cell in np.unique(np.concatenate((sources[crossing], graph.indices[crossing]))).tolist():
+            entrances.setdefault(cluster_list[cell], set()).add(cell)
+
+        if cells is None:
+            self.intra = {}
+        else:
+            stale = {cluster_list[cell] for cell in np.asarray(cells).tolist()}
+            stale.update(cluster for cluster in set(entrances) | set(self.entrances)
+                         if entrances.get(cluster) != self.entrances.get(cluster))
+            for cluster in stale:
+                self.intra.pop(cluster, None)
+        self.cluster_of = cluster_list
+        self.inter = inter
+        self.entrances = entrances
+
+    def precompute(self):
+        """
+        Computes the links of every cluster now rather than on first use.
+        """
+        for cluster in self.entrances:
+            self.cluster_links(cluster)
+
+    def cluster_links(self, cluster):
+        """
+        Returns {entrance: {other entrance: distance}} of a cluster, computing it if needed.
+        """
+        links = self.intra.get(cluster)
+        if links is None:
+            links = {}
+            entrances = self.entrances.get(cluster, ())
+            for entrance in entrances:
+                distance, _ = self.local_search(entrance, cluster)
+                links[entrance] = {other: distance[other] for other in entrances
+                                   if other != entrance and other in distance}
+            self.intra[cluster] = links
+        return links
+
+    def local_search(self, source, cluster, reverse=False):
+        """
+        Static distances from 'source' to the cells of 'cluster' it reaches without
+        leaving it (from them to 'source' if 'reverse'). Returns them and the expansions.
+        """
+        edges = self.graph.reverse_edges if reverse else self.graph.edges
+        cluster_of = self.cluster_of
+        distance = {source: 0}
+        frontier = [(0, source)]
+        expansions = 0
+        while frontier:
+            cost, cell = heapq.heappop(frontier)
+            if cost > distance[cell]:
+                continue
+            expansions += 1
+            for other, edge_cost in edges(cell):
+                new_cost = cost + edge_cost
+                if cluster_of[other] == cluster and new_cost < distance.get(other, math.inf):
+                    distance[other] = new_cost
+                    heapq.heappush(frontier, (new_cost, other))
+        return distance, expansions
+
+    def abstract_path(self, start, goal):
+        """
+        Plans a trip from cell id 'start' to cell id 'goal' on the abstract graph.
+        Returns a SearchResult whose path holds start, the entrances the trip goes
+        through and goal, or is [] if the goal can't be reached.
+        """
+        graph = self.graph
+        start_cluster, goal_cluster = self.cluster_of[start], self.cluster_of[goal]
+        from_start, expansions = self.local_search(start, start_cluster)
+        to_goal, goal_expansions = self.local_search(goal, goal_cluster, reverse=True)
+        expansions += goal_expansions
+        start_links = {cell: cost for cell, cost in from_start.items()
+                       if cell == goal or cell in self.entrances.get(start_cluster, ())}
+        gx, gy = graph.cell_pos(goal)
+
+        def heuristic(cell):
+            x, y = graph.cell_pos(cell)
+            return math.sqrt((gx - x) ** 2 + (gy - y) ** 2)
+
+        def neighbours(cell):
+            if cell == start:
+                yield from start_links.items()
+            else:
+                cluster = self.cluster_of[cell]
+                yield from self.cluster_links(cluster).get(cell, {}).items()
+                if cluster == goal_cluster and cell in to_goal:
+                    yield goal, to_goal[cell]
+            yield from self.inter.get(cell, ())
+
+        counter = 0
+        frontier = [(heuristic(start), counter, start)]
+        came_from = {}
+        cost_so_far = {start: 0}
+        while frontier:
+            priority, _, current = heapq.heappop(frontier)
+            if current == goal:
+                path = [current]
+                while current in came_from:
+                    current = came_from[current]
+                    path.append(current)
+                return SearchResult(path[::-1], expansions, cost_so_far.keys())
+            cost = cost_so_far[current]
+            if priority > cost + heuristic(current):
+                continue  # Stale entry
+            expansions += 1
+            for next_cell, edge_cost in neighbours(current):
+                new_cost = cost + edge_cost
+                if new_cost < cost_so_far.get(next_cell, math.inf):
+                    cost_so_far[next_cell] = new_cost
+                    counter += 1
+                    heapq.heappush(frontier, (new_cost + heuristic(next_cell), counter, next_cell))
+                    came_from[next_cell] = current
+        return SearchResult([], expansions, cost_so_far.keys())
+
+    def refine(self, start, target, is_blocked=None):
+        """
+        Turns the abstract segment from 'start' to 'target' into the cells to follow,
+        'start' excluded. A segment between two clusters is the one edge linking them.
+        Inside a cluster, cells blocked by cars or red lights cost BLOCKED_PENALTY to
+        leave, so the car goes around them when it can and waits for them otherwise.
+        """
+        cluster = self.cluster_of[start]
+        if self.cluster_of[target] != cluster:
+            return SearchResult([target], 0, (start, target))
+        graph = self.graph
+        tx, ty = graph.cell_pos(target)
+
+        def heuristic(cell):
+            x, y = graph.cell_pos(cell)
+            return math.sqrt((tx - x) ** 2 + (ty - y) ** 2)
+
+        counter = 0
+        frontier = [(heuristic(start), counter, start)]
+        came_from = {}
+        cost_so_far = {start: 0}
+        expansions = 0
+        while frontier:
+            priority, _, current = heapq.heappop(frontier)
+            if current == target:
+                path = []
+                while current in came_from:
+                    path.append(current)
+                    current = came_from[current]
+                return SearchResult(path[::-1], expansions, cost_so_far.keys())
+            cost = cost_so_far[current]
+            if priority > cost + heuristic(current):
+                continue  # Stale entry
+            expansions += 1
+            penalty = BLOCKED_PENALTY if current != start and is_blocked is not None and is_blocked(current) else 0
+            for next_cell, edge_cost in graph.edges(current):
+                new_cost = cost + edge_cost + penalty
+                if self.cluster_of[next_cell] == cluster and new_cost < cost_so_far.get(next_cell, math.inf):
+                    cost_so_far[next_cell] = new_cost
+                    counter += 1
+                    heapq.heappush(frontier, (new_cost + heuristic(next_cell), counter, next_cell))
+                    came_from[next_cell] = current
+        return SearchResult([], expansions, cost_so_far.keys())
@@ -0,0 +1,111 @@
+import numpy as np
+from roadgraph import DIRECTION_BITS
+
+# Terrain codes, the static agent on top of each cell
+EMPTY = 0
+ROAD = 1
+BUILDING = 2
+PARKING = 3
+ROUNDABOUT = 4
+STOPLIGHT = 5
+
+# Signal states, NO_SIGNAL where there is no stoplight
+NO_SIGNAL = -1
+GREEN = 0
+YELLOW = 1
+RED = 2
+SIGNAL_CODES = {"green": GREEN, "yellow": YELLOW, "red": RED}
+
+# Bit of the direction mask for every unit move
+OFFSET_BITS = {(-1, 0): DIRECTION_BITS["W"], (0, -1): DIRECTION_BITS["S"],
+               (0, 1): DIRECTION_BITS["N"], (1, 0): DIRECTION_BITS["E"]}
+
+
+class CellLayers:
+    """
+    Dense per-cell state kept next to the MultiGrid, indexed [x, y] like the grid.
+
+    terrain: code of the static agent on top of the cell.
+    directions: bitmask of the moves allowed from the cell by its road.
+    main_direction: index into roadgraph.DIRECTIONS of the road's main flow, -1 if none.
+    passable: whether a car may enter the cell, ignoring cars and signals.
+    drivable: whether the cell holds a road or a parking spot (a car there keeps running).
+    occupancy: number of cars on the cell.
+    signal: state of the stoplight on the cell, NO_SIGNAL if there is none.
+
+    The flat views share memory with the 2D arrays and are indexed by RoadGraph cell id.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        shape = (width, height)
+        self.terrain = np.zeros(shape, dtype=np.int8)
+        self.directions = np.zeros(shape, dtype=np.uint8)
+        self.main_direction = np.full(shape, -1, dtype=np.int8)
+        self.passable = np.zeros(shape, dtype=bool)
+        self.drivable = np.zeros(shape, dtype=bool)
+        self.occupancy = np.zeros(shape, dtype=np.int32)
+        self.signal = np.full(shape, NO_SIGNAL, dtype=np.int8)
+        self.occupancy_flat = self.occupancy.reshape(-1)
+        self.signal_flat = self.signal.reshape(-1)
+        # Memoryviews over the same buffers, reading one cell through them returns a plain
+        # int and is much cheaper than indexing the numpy arrays from Python
+        self._occupancy = memoryview(self.occupancy_flat)
+        self._signal = memoryview(self.signal_flat)
+        self._static = None
+
+    def freeze_static(self):
+        """
+        Takes the fast-read views of the static layers, once they are filled in.
+        """
+        self._static = (memoryview(self.directions.reshape(-1)), memoryview(self.passable.reshape(-1)),
+                        memoryview(self.drivable.reshape(-1)))
+
+    def in_bounds(self, pos):
+        return 0 <= pos[0] < self.width and 0 <= pos[1] < self.height
+
+    def add_car(self, pos):
+        self.occupancy[pos] += 1
+
+    def remove_car(self, pos):
+        self.occupancy[pos] -= 1
+
+    def set_signal(self, pos, color):
+        self.signal[pos] = SIGNAL_CODES.get(color, NO_SIGNAL)
+
+    def can_move(self, pos, current):
+        """
+        Returns (can_move, running) for a car at 'current' trying to enter 'pos', the same
+        verdict the agents on the cell used to give. running is None if they didn't set it.
+        """
+        if pos == current:
+            return True, None
+        if not self.in_bounds(pos):
+            return False, None
+        cell = pos[0] * self.height + pos[1]
+        _, passable, drivable = self._static
+        signal = self._signal[cell]
+        if signal != NO_SIGNAL:
+            running = signal != RED
+        elif drivable[cell]:
+            running = True
+        else:
+            running = None
+        if self._occupancy[cell] > 0:
+            return False, running
+        if signal != NO_SIGNAL:
+            return running, running
+        return bool(passable[cell]), running
+
+    def direction_is_available(self, curr, next_pos):
+        bit = OFFSET_BITS.get((next_pos[0] - curr[0], next_pos[1] - curr[1]))
+        return bit is not None and bool(self._static[0][curr[0] * self.height + curr[1]] & bit)
+
+    def is_blocked(self, cell):
+        """
+        Whether a car or a red light is on the cell with id 'cell'.
+        """
+        return self._occupancy[cell] > 0 or self._signal[cell] == RED
+
+    def blocked_mask(self):
+        return (self.occupancy > 0) | (self.signal == RED)
@@ -0,0 +1,174 @@
+import os
+import hashlib
+import numpy as np
+from roadgraph import DIRECTIONS, DIRECTION_BITS
+from layers import EMPTY, ROAD, BUILDING, PARKING, ROUNDABOUT, STOPLIGHT, NO_SIGNAL, GREEN, RED
+
+# Files of a layout: the map and the allowed directions, then the main flow of the roads
+MAP_FILES = ("layout.txt", "flowN.txt", "flowS.txt", "flowE.txt", "flowW.txt")
+MAIN_FLOW_FILE = "mainFlow.txt"
+# Bump when the compiled format or the parsing rules change, old cache files are then ignored
+CACHE_VERSION = 2
+# Directory of the compiled layouts, inside the layout directory
+CACHE_DIR = "__layoutcache__"
+
+# Static items of the map characters, placed in this order so the later ones end on top
+TOP_ITEMS = {"%": BUILDING, "B": ROUNDABOUT, "R": STOPLIGHT, "G": STOPLIGHT}
+# Order the roads took their first direction in, and so their main one without a main flow
+ROAD_ORDER = ("N", "S", "E", "W")
+
+
+def read_grid(filename):
+    """
+    Returns the cells of a layout file as rows of strings, bottom row first so that
+    rows[y][x] is the cell at (x, y).
+    """
+    with open(filename, "r") as file:
+        return [line.strip().split(",") for line in file.readlines()][::-1]
+
+
+class Layout:
+    """
+    A parsed and merged map, as (width, height) arrays indexed [x, y].
+
+    terrain: code of the top static item of the cell (layers.ROAD ... layers.STOPLIGHT).
+    directions: bitmask of roadgraph.DIRECTION_BITS allowed from the cell, 0 if no road.
+    main_direction: index into roadgraph.DIRECTIONS of the road's main flow, -1 if none.
+    spot: number of the parking spot on the cell, -1 if none.
+    signal: initial colour code of the stoplight on the cell, layers.NO_SIGNAL if none.
+
+    A cell holds a road and at most one other item on top of it.
+    """
+    fields = ("terrain", "directions", "main_direction", "spot", "signal")
+
+    def __init__(self, terrain, directions, main_direction, spot, signal):
+        self.terrain = terrain
+        self.directions = directions
+        self.main_direction = main_direction
+        self.spot = spot
+        self.signal = signal
+        self.width, self.height = terrain.shape
+
+    @property
+    def drivable(self):
+        return (self.directions != 0) | (self.terrain == PARKING)
+
+    @property
+    def passable(self):
+        return np.isin(self.terrain, (ROAD, PARKING, STOPLIGHT))
+
+    def positions(self, mask):
+        """
+        Returns the (x, y) of the cells of a mask, in the order the layout files list them
+        (row by row from the bottom, left to right).
+        """
+        xs, ys = np.nonzero(mask)
+        order = np.lexsort((xs, ys))
+        return list(zip(xs[order].tolist(), ys[order].tolist()))
+
+    def parking_spots(self):
+        return [(x, y, str(self.spot[x, y])) for x, y in self.positions(self.spot >= 0)]
+
+    def stoplights(self, color):
+        return self.positions(self.signal == color)
+
+    def save(self, path):
+        np.savez(path, version=CACHE_VERSION, **{field: getattr(self, field) for field in self.fields})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["version"]) != CACHE_VERSION:
+                raise ValueError(f"Compiled layout {path} has version {int(data['version'])}")
+            return cls(*(data[field] for field in cls.fields))
+
+
+def parse_layout(layout_dir="."):
+    """
+    Parses the layout files of 'layout_dir' into a Layout. Every map file may hold any
+    item, the letters N, S, E and W of all of them are the directions of the roads.
+    """
+    grids = [read_grid(os.path.join(layout_dir, name)) for name in MAP_FILES]
+    main_flow = read_grid(os.path.join(layout_dir, MAIN_FLOW_FILE))
+    width = max(len(row) for grid in grids for row in grid)
+    height = max(len(grid) for grid in grids)
+
+    terrain = np.full((width, height), EMPTY, dtype=np.int8)
+    directions = np.zeros((width, height), dtype=np.uint8)
+    first_direction = np.full((width, height), len(ROAD_ORDER), dtype=np.int8)
+    spot = np.full((width, height), -1, dtype=np.int32)
+    signal = np.full((width, height), NO_SIGNAL, dtype=np.int8)
+    # Rank in top_order of the top item so far, the later ones were placed last and win
+    top_order = ("%", "digit", "B", "R", "G")
+    top_rank = np.full((width, height), -1, dtype=np.int8)
+
+    for grid in grids:
+        for y, row in enumerate(grid):
+            for x, element in enumerate(row):
+                if element in DIRECTION_BITS:
+                    directions[x, y] |= DIRECTION_BITS[element]
+                    first_direction[x, y] = min(first_direction[x, y], ROAD_ORDER.index(element))
+                    continue
+                if element.isdigit():
+                    spot[x, y] = int(element)
+                    rank, code = top_order.index("digit"), PARKING
+                elif element in TOP_ITEMS:
+                    rank, code = top_order.index(element), TOP_ITEMS[element]
+                    # Green stoplights were placed after the red ones
+                    if element == "G":
+                        signal[x, y] = GREEN
+                    elif element == "R" and signal[x, y] != GREEN:
+                        signal[x, y] = RED
+                else:
+                    continue
+                if rank > top_rank[x, y]:
+                    top_rank[x, y] = rank
+                    terrain[x, y] = code
+
+    is_road = directions != 0
+    terrain[is_road & (terrain == EMPTY)] = ROAD
+    main_direction = np.full((width, height), -1, dtype=np.int8)
+    for x, y in zip(*np.nonzero(is_road)):
+        main_direction[x, y] = DIRECTIONS.index(ROAD_ORDER[first_direction[x, y]])
+    for y, row in enumerate(main_flow):
+        for x, element in enumerate(row):
+            if element in DIRECTION_BITS and x < width and y < height and is_road[x, y]:
+                main_direction[x, y] = DIRECTIONS.index(element)
+    return Layout(terrain, directions, main_direction, spot, signal)
+
+
+def source_hash(layout_dir="."):
+    """
+    Hash of the contents of the layout files of 'layout_dir' and of the cache version.
+    """
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    for name in MAP_FILES + (MAIN_FLOW_FILE,):
+        with open(os.path.join(layout_dir, name), "rb") as file:
+            digest.update(name.encode() + b"\0" + file.read() + b"\0")
+    return digest.hexdigest()
+
+
+def load_layout(layout_dir=".", cache=True):
+    """
+    Returns the Layout of 'layout_dir', from its compiled file if the layout files didn't
+    change since it was written. Otherwise the files are parsed and the result compiled
+    into CACHE_DIR for the next time (silently skipped if the directory isn't writable).
+    """
+    if not cache:
+        return parse_layout(layout_dir)
+    path = os.path.join(layout_dir, CACHE_DIR, f"layout-{source_hash(layout_dir)[:32]}.npz")
+    if os.path.exists(path):
+        try:
+            return Layout.load(path)
+        except (OSError, ValueError, KeyError):
+            pass  # Unreadable or stale, compile it again
+    layout = parse_layout(layout_dir)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name first, a concurrent reader never sees half a file
+        temporary = f"{path}.{os.getpid()}.tmp.npz"
+        layout.save(temporary)
+        os.replace(temporary, path)
+    except OSError:
+        pass
+    return layout
@@ -0,0 +1,95 @@
+import io
+import time
+import pstats
+import cProfile
+import numpy as np
+
+# Percentiles reported for every phase
+PERCENTILES = (50, 90, 99)
+
+
+class StepTimer:
+    """
+    Wall time of every phase of the last 'capacity' steps, kept in a ring buffer.
+
+    Runs the phases of a step, a sequence of (name, function) pairs. While it is off the
+    phases are only called, nothing is timed. profile(n) also runs the next n steps
+    under cProfile and keeps the report in 'last_profile'.
+    """
+    def __init__(self, phases, capacity=1024, enabled=False):
+        self.phases = tuple(phases)
+        self.capacity = capacity
+        self.enabled = enabled
+        # One row per step: the seconds of every phase, then the whole step
+        self.samples = np.zeros((capacity, len(self.phases) + 1))
+        self.count = 0
+        self.profiler = None
+        self.profile_steps = 0
+        self.last_profile = None
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self.count = 0
+
+    def profile(self, steps):
+        """
+        Captures a cProfile of the next 'steps' steps.
+        """
+        self.profiler = cProfile.Profile()
+        self.profile_steps = steps
+
+    def run(self):
+        """
+        Runs one step, timing it if the timer is on.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.enable()
+        if self.enabled:
+            row = self.samples[self.count % self.capacity]
+            start = previous = time.perf_counter()
+            for i, (_, phase) in enumerate(self.phases):
+                phase()
+                now = time.perf_counter()
+                row[i] = now - previous
+                previous = now
+            row[-1] = previous - start
+            self.count += 1
+        else:
+            for _, phase in self.phases:
+                phase()
+        if profiler is not None:
+            profiler.disable()
+            self.profile_steps -= 1
+            if self.profile_steps <= 0:
+                self._finish_profile()
+
+    def _finish_profile(self, limit=30):
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        self.last_profile = out.getvalue()
+        self.profiler = None
+
+    def summary(self):
+        """
+        Returns {"steps", "enabled", "profiling", "phases": {name: {"mean", "max", "p50",
+        "p90", "p99"}}} over the steps in the buffer, times in milliseconds. The whole
+        step is reported as the "total" phase.
+        """
+        filled = self.samples[:min(self.count, self.capacity)] * 1e3
+        phases = {}
+        for i, name in enumerate([name for name, _ in self.phases] + ["total"]):
+            if len(filled):
+                column = filled[:, i]
+                stats = {"mean": float(column.mean()), "max": float(column.max())}
+                stats.update({f"p{q}": float(v) for q, v in zip(PERCENTILES, np.percentile(column, PERCENTILES))})
+            else:
+                stats = {}
+            phases[name] = stats
+        return {"steps": len(filled), "enabled": self.enabled,
+                "profiling": self.profiler is not None, "phases": phases}
@@ -1,8 +1,18 @@
 import mesa
-import random
+import os
 import json
+import numpy as np
 from agents import *
+from roadgraph import RoadGraph
+from layers import *
+from signals import SignalController
+from frames import FrameHistory, Frame, car_json, encode_binary
+from search import FlowField, Landmarks
+from routecache import RouteCache
+from metrics import StepTimer
+from layout import Layout, load_layout
 from scheduler import RandomActivationByTypeFiltered
+from hpa import HierarchicalPlanner
 
 class StreetView(mesa.Model):
     """Main model: StreetView, controlls agents
@@ -14,175 +24,95 @@ class StreetView(mesa.Model):
         None: No returns
     """
     description = "MESA Visualization of the street cross simulation."
+    routing_modes = ("astar", "flowfield", "incremental", "hierarchical")
+    heuristics = ("euclidean", "alt")
     
     def __init__(    
         self,
-        width=24,
-        height=24,
+        width=None,
+        height=None,
+        routing="astar",
+        route_cache_size=1024,
+        heuristic="euclidean",
+        landmark_count=4,
+        keyframe_interval=50,
+        max_cars=16,
+        initial_cars=8,
+        car_limit=50,
+        layout_dir=".",
+        layout_cache=True,
+        layout=None,
+        seed=None,
+        step_timing=False,
+        recycle_car_ids=False,
+        cluster_size=16,
     ):
         super().__init__()
+        # Every random choice of the model (spawn and goal spots, activation order) comes
+        # from self.random, so a given seed replays the same run in any process
+        if seed is not None:
+            self.reset_randomizer(seed)
+        if routing not in self.routing_modes:
+            raise ValueError(f"Unknown routing mode: {routing}")
+        if heuristic not in self.heuristics:
+            raise ValueError(f"Unknown heuristic: {heuristic}")
+        self.routing = routing
+        self.heuristic = heuristic
         self.active_cars = 0
-        self.max_cars = 16
-        initial_cars_num = 8
+        self.max_cars = max_cars
+        initial_cars_num = initial_cars
+        # Nodes expanded by the cars' searches during the current step
+        self.search_expansions = 0
         # For control
         self.finished_cars = 0
-        self.car_limit = 50
+        self.car_limit = car_limit
         
-        def read_matrix(filename):
-            nmat = []
-            with open(filename, 'r') as file:
-                matrix = [line.strip().split(',') for line in file.readlines()]
-                for row in matrix[::-1]:
-                    nmat.append(row)
-
-            # Iterate through the matrix and print the type of each element
-            for y, row in enumerate(nmat):
-                for x, element in enumerate(row):
-                    if element == '-' or element == "":
-                        continue
-                    elif element == 'G':
-                        position = (x,y)
-                        self.green_positions.append(position)
-                    elif element == 'R':
-                        position = (x,y)
-                        self.red_positions.append(position)
-                    elif element == '%':
-                        position = (x,y)
-                        self.building_positions.append(position)
-                    elif element == 'B':
-                        position = (x,y)
-                        self.roundAbout_positions.append(position)
-                    elif element.isdigit():
-                        position = (x,y,element)
-                        self.parkingSpots_positions.append(position)
-                    elif element == 'N':
-                        position = (x,y,element)
-                        self.road_N.append(position)
-                    elif element == 'S':
-                        position = (x,y,element)
-                        self.road_S.append(position)
-                    elif element == 'E':
-                        position = (x,y,element)
-                        self.road_E.append(position)
-                    elif element == 'W':
-                        position = (x,y,element)
-                        self.road_W.append(position)
-                    else:
-                        continue
-        
-
-        def make_flow(filename):
-            nmat = []
-            with open(filename, 'r') as file:
-                matrix = [line.strip().split(',') for line in file.readlines()]
-                for row in matrix[::-1]:
-                    nmat.append(row)
-
-            # Iterate through the matrix and print the type of each element
-            for y, row in enumerate(nmat):
-                for x, element in enumerate(row):
-                    if element == '-' or element == "":
-                        continue
-                    elif element == 'N':
-                        position = (x,y,element)
-                        self.flow.append(position)
-                    elif element == 'S':
-                        position = (x,y,element)
-                        self.flow.append(position)
-                    elif element == 'E':
-                        position = (x,y,element)
-                        self.flow.append(position)
-                    elif element == 'W':
-                        position = (x,y,element)
-                        self.flow.append(position)
-                        
-        # Set parameters
-        self.width = width
-        self.height = height
-        # Main flow of the roads
-        self.flow = []
-        # Available choices for the cars to move
-        self.road_N = []
-        self.road_S = []
-        self.road_E = []
-        self.road_W = []
-        # For iteration over all road elements
-        self.road = [self.road_N, self.road_S, self.road_E, self.road_W]
-        # Other agents
-        self.building_positions = []
-        self.roundAbout_positions = []
-        self.parkingSpots_positions = []
+        # The map: parsed layout files, or their compiled copy if they didn't change. A
+        # Layout (or the path of one saved with Layout.save) can be given instead
+        self.layout_dir = layout_dir
+        if layout is None:
+            layout = load_layout(layout_dir, layout_cache)
+        elif isinstance(layout, (str, os.PathLike)):
+            layout = Layout.load(layout)
+        self.layout = layout
+        # Set parameters, the grid is the size of the layout unless told otherwise
+        self.width = width if width is not None else layout.width
+        self.height = height if height is not None else layout.height
+        if layout.width > self.width or layout.height > self.height:
+            raise ValueError(f"The layout is {layout.width}x{layout.height}, "
+                             f"it doesn't fit a {self.width}x{self.height} grid")
+        # Static map, kept as arrays in the cell layers rather than as agents
+        self.building_positions = self.layout.positions(self.layout.terrain == BUILDING)
+        self.roundAbout_positions = self.layout.positions(self.layout.terrain == ROUNDABOUT)
+        self.parkingSpots_positions = self.layout.parking_spots()
         # Stoplights
-        self.green_positions = []
-        self.red_positions = []
+        self.green_positions = self.layout.stoplights(GREEN)
+        self.red_positions = self.layout.stoplights(RED)
         # Cars
         self.car_positions = []
-
-        # Read the file content
-        read_matrix('layout.txt')
-        read_matrix('flowN.txt')
-        read_matrix('flowS.txt')
-        read_matrix('flowE.txt')
-        read_matrix('flowW.txt')
-        make_flow('mainFlow.txt')
+        # Retired cars, reused by new_car instead of allocating new ones. Their ids are
+        # only reused with 'recycle_car_ids', clients then see a new car under an old id
+        self.car_pool = []
+        self.recycle_car_ids = recycle_car_ids
+        self.free_car_ids = []
+        # Cars that reached their goal this step, removed by check_active
+        self.retiring = []
 
         self.schedule = RandomActivationByTypeFiltered(self)
+        self.schedule.add_filter("running", Car, lambda car: car.running, ["running"])
         self.grid = mesa.space.MultiGrid(self.width, self.height, torus=False)
         self.datacollector = mesa.DataCollector(
             {
-                "Buildings": lambda b: b.schedule.get_type_count(Buildings),
-                "Parking Spots": lambda p: p.schedule.get_type_count(ParkingSpots),
-                "Round About": lambda r: r.schedule.get_type_count(RoundAbout),
+                "Buildings": lambda b: b.static_counts["Buildings"],
+                "Parking Spots": lambda p: p.static_counts["Parking Spots"],
+                "Round About": lambda r: r.static_counts["Round About"],
                 "Stoplights": lambda s: s.schedule.get_type_count(Stoplight),
                 "Cars": lambda c: c.schedule.get_type_count(Car),
+                "Running Cars": lambda c: c.schedule.get_type_count(Car, "running"),
+                "Search Expansions": lambda m: m.search_expansions,
             }
         )
 
-        # Create roads at specified positions
-        for compass_rose in self.road: 
-            for pos in compass_rose:
-                x, y, direction = pos
-                this_cell =self.grid.get_cell_list_contents((x,y))
-                
-                if self.grid.is_cell_empty((x,y)):
-                    road = Road(self.next_id(), (x, y), self, direction)
-                    self.grid.place_agent(road, (x, y))
-                    self.schedule.add(road)
-
-                for a in this_cell:
-                    if isinstance(a, Road):
-                        a.add_direction(direction)
-        
-        # Set the main directions for the roads
-        for pos in self.flow:
-            x, y, direction = pos
-            this_cell =self.grid.get_cell_list_contents((x,y))
-            
-            for a in this_cell:
-                if isinstance(a, Road):
-                    a.set_main_direction(direction)
-
-        # Create buildings at specified positions
-        for pos in self.building_positions:
-            x, y = pos
-            building = Buildings(self.next_id(), (x, y), self)
-            self.grid.place_agent(building, (x, y))
-            self.schedule.add(building)
-
-        # Create parking spots at specified positions
-        for pos in self.parkingSpots_positions:
-            x, y, number = pos
-            parkingSpot = ParkingSpots(self.next_id(), (x, y), number, self)
-            self.grid.place_agent(parkingSpot, (x, y))
-            self.schedule.add(parkingSpot)
-
-        # Create round about
-        for pos in self.roundAbout_positions:
-            x, y = pos
-            roundAbout = RoundAbout(self.next_id(), (x, y), self)
-            self.grid.place_agent(roundAbout, (x, y))
-            self.schedule.add(roundAbout)
-
         # Create stop 
         for pos in self.red_positions:
             x, y = pos
@@ -198,27 +128,169 @@ class StreetView(mesa.Model):
             self.grid.place_agent(go, (x, y))
             self.schedule.add(go)
 
+        # Compile the static map into cell layers and the road network for the cars' path search
+        self.layers = self.compile_layers()
+        # The static map never changes, its counts for the data collector are taken once
+        self.static_counts = {"Buildings": len(self.building_positions),
+                              "Parking Spots": len(self.parkingSpots_positions),
+                              "Round About": len(self.roundAbout_positions)}
+        self.road_graph = RoadGraph(self.layers.directions, self.layers.main_direction, self.layers.passable)
+        # Colour of every stoplight from the global step number
+        self.signals = SignalController(self.layers, self.schedule.agents_by_type[Stoplight].values())
+        # Distance and next hop towards every parking spot, used by the flow field routing
+        self.flow_fields = {}
+        if self.routing == "flowfield":
+            self.compute_flow_fields()
+        # Landmark distances for the ALT heuristic
+        self.landmark_count = landmark_count
+        self.landmarks = None
+        if self.heuristic == "alt":
+            self.landmarks = Landmarks(self.road_graph, landmark_count)
+        # Clusters and entrances of the map for the hierarchical routing
+        self.hierarchy = None
+        if self.routing == "hierarchical":
+            self.hierarchy = HierarchicalPlanner(self.road_graph, cluster_size)
+        # Paths already searched, dropped when a cell their search went through changes
+        self.route_cache = RouteCache(self.road_graph.size, route_cache_size)
 
         self.make_cars(initial_cars_num)        
 
+        # Car states of the last steps, for the delta frames of get_info
+        self.step_count = 0
+        self.frames = FrameHistory(keyframe_interval)
+        self.frames.record(self.step_count, self.car_states())
+
+        # Phases of a step, timed per phase while step_timer is enabled
+        self.step_timer = StepTimer((("cars", self.step_cars),
+                                     ("signals", self.step_signals),
+                                     ("retire", self.check_active),
+                                     ("frames", self.record_frame),
+                                     ("collect", self.collect)), enabled=step_timing)
+
         self.running = True
         self.datacollector.collect(self)
     
+    def compile_layers(self):
+        """
+        Builds the CellLayers of the map from the layout arrays: terrain codes, direction
+        masks, main flow, passability and the initial stoplight colors. A cell is passable
+        when a car could enter it with no other car or red light on it, decided by the top
+        static item of the cell like the old per-agent checks did.
+        """
+        layers = CellLayers(self.width, self.height)
+        layout = self.layout
+        area = (slice(0, layout.width), slice(0, layout.height))
+        layers.terrain[area] = layout.terrain
+        layers.directions[area] = layout.directions
+        layers.main_direction[area] = layout.main_direction
+        layers.passable[area] = layout.passable
+        layers.drivable[area] = layout.drivable
+        layers.signal[area] = layout.signal
+        layers.freeze_static()
+        return layers
+
+    def update_layout(self, layout):
+        """
+        Switches to an edited layout of the same size while the model runs, e.g. with a
+        road closed. Only roads and buildings may change, not the parking spots or the
+        stoplights. The routes searched and the clusters of the hierarchical routing are
+        only dropped where the map changed.
+        """
+        old = self.layout
+        if (layout.width, layout.height) != (old.width, old.height):
+            raise ValueError(f"The layout is {layout.width}x{layout.height}, not {old.width}x{old.height}")
+        if not (np.array_equal(layout.spot, old.spot) and np.array_equal(layout.signal, old.signal)):
+            raise ValueError("The parking spots and the stoplights of a running model can't change")
+        changed = np.zeros((self.width, self.height), dtype=bool)
+        area = (slice(0, layout.width), slice(0, layout.height))
+        changed[area] = ((layout.terrain != old.terrain) | (layout.directions != old.directions)
+                         | (layout.main_direction != old.main_direction))
+        cells = np.flatnonzero(changed)
+
+        self.layout = layout
+        self.building_positions = layout.positions(layout.terrain == BUILDING)
+        self.roundAbout_positions = layout.positions(layout.terrain == ROUNDABOUT)
+        self.static_counts["Buildings"] = len(self.building_positions)
+        self.static_counts["Round About"] = len(self.roundAbout_positions)
+        layers = self.layers  # Updated in place, the signals and the car occupancy stay
+        layers.terrain[area] = layout.terrain
+        layers.directions[area] = layout.directions
+        layers.main_direction[area] = layout.main_direction
+        layers.passable[area] = layout.passable
+        layers.drivable[area] = layout.drivable
+        self.road_graph = RoadGraph(layers.directions, layers.main_direction, layers.passable)
+
+        self.cells_changed(cells)
+        if self.flow_fields:
+            self.compute_flow_fields()
+        if self.landmarks is not None:
+            self.landmarks = Landmarks(self.road_graph, self.landmark_count)
+        if self.hierarchy is not None:
+            self.hierarchy.update(self.road_graph, cells)
+        for car in self.schedule.agents_by_type[Car].values():
+            car.planner = None
+            car.route = []
+            car.route_index = 0
+
+    def compute_flow_fields(self):
+        """
+        Precomputes the flow field of every parking spot over the static road graph.
+        Only needs to run again if the layout changes.
+        """
+        self.flow_fields = {}
+        for x, y, number in self.parkingSpots_positions:
+            self.flow_fields[(x, y)] = FlowField(self.road_graph, self.road_graph.cell_id((x, y)))
+
+    def search_heuristic(self, goal):
+        """
+        Returns the heuristic function of the car search towards the cell id 'goal'.
+        """
+        if self.landmarks is not None:
+            return self.landmarks.heuristic(goal)
+        return None
+
+    def blocked_cells(self):
+        """
+        Returns the set of ids of the cells currently blocked by a car or a red stoplight.
+        """
+        return set(np.flatnonzero(self.layers.blocked_mask()).tolist())
+
+    def cell_changed(self, pos):
+        """
+        Called when a car enters or leaves a cell or a stoplight turns red or stops being red.
+        """
+        self.route_cache.cell_changed(self.road_graph.cell_id(pos))
+
+    def cells_changed(self, cells):
+        """
+        Same as cell_changed for an array of cell ids.
+        """
+        for cell in cells.tolist():
+            self.route_cache.cell_changed(cell)
+
+    def car_entered(self, pos):
+        self.layers.add_car(pos)
+        self.cell_changed(pos)
+
+    def car_left(self, pos):
+        self.layers.remove_car(pos)
+        self.cell_changed(pos)
+
     def make_cars(self, cars_num):
         # Store available parking spots
         self.available_spots = list(self.parkingSpots_positions)
         # Create cars with random parking spot as initial position and set a different parking spot as the goal
         for i in range(cars_num):  # Replace initial_cars_num with your desired number of cars
             # Get a random parking spot as the initial position for the car
-            initial_spot = random.choice(self.available_spots)
+            initial_spot = self.random.choice(self.available_spots)
             x, y, spot_num1 = initial_spot
-            car = Car(self.next_id(), (x, y), self)
+            car = self.new_car((x, y))
 
             # Remove the selected initial spot from available spots
             self.available_spots.remove(initial_spot)
 
             # Get a different random parking spot as the goal for the car
-            goal_spot = random.choice(self.available_spots)
+            goal_spot = self.random.choice(self.available_spots)
             x2, y2, spot_num2 = goal_spot
             car.goal_pos = (goal_spot[0], goal_spot[1])
             car.set_spots(spot_num1,spot_num2)
@@ -226,6 +298,7 @@ class StreetView(mesa.Model):
             
             self.grid.place_agent(car, (x, y))
             self.schedule.add(car)
+            self.car_entered((x, y))
 
             self.active_cars += 1
             self.finished_cars += 1
@@ -233,6 +306,29 @@ class StreetView(mesa.Model):
             self.available_spots.append(initial_spot)
 
 
+    def new_car(self, pos):
+        """
+        Returns a car at 'pos', a retired one from the pool if there is any.
+        """
+        if self.recycle_car_ids and self.free_car_ids:
+            unique_id = self.free_car_ids.pop()
+        else:
+            unique_id = self.next_id()
+        if not self.car_pool:
+            return Car(unique_id, pos, self)
+        car = self.car_pool.pop()
+        car.unique_id = unique_id
+        car.spawn(pos)
+        return car
+
+    def recycle_car(self, car):
+        """
+        Keeps a car that left the grid and the schedule for new_car to reuse.
+        """
+        self.car_pool.append(car)
+        if self.recycle_car_ids:
+            self.free_car_ids.append(car.unique_id)
+
     def check_available_spots(self):
         # Check for available spots and spawn cars
         if self.active_cars < self.max_cars and len(self.available_spots) >= 2:
@@ -242,55 +338,108 @@ class StreetView(mesa.Model):
         
         
 
-    def get_info(self):
+    def car_states(self):
+        """
+        Returns {car_id: (x, z, direction x, direction z)} of the cars on the grid.
+        """
+        return {a.unique_id: (a.pos[0], a.pos[1], a.current_direction[0], a.current_direction[1])
+                for a in self.schedule.agents_by_type[Car].values()}
+
+    def get_stoplight_info(self):
+        stoplight_info = []
+        colors = []
+        for a in self.schedule.agents_by_type[Stoplight].values():
+            if a.color not in colors:
+                stoplight_info.append({"stop_type":a.type,
+                                       "color":a.color})
+                colors.append(a.color)
+        return stoplight_info
+
+    def get_info(self, since=None):
         """ 
         Method that retrieves the information of a step, for JSON output (MESA>>Flask>>Unity) 
+
+        With 'since', the last step the client acknowledged, only the cars added, changed
+        or removed since then are sent: {"step", "since", "keyframe": false, "added",
+        "changed", "removed", "stoplights"}. A full frame {"step", "keyframe": true, "cars",
+        "stoplights"} is sent instead when that step is too old or a keyframe is due.
         """
-        self.car_info = []
-        self.stoplight_info = []
-        colors = []
-        for a in self.schedule.agents:
-            if isinstance(a, Car):
-                # Add to car_info
-                self.car_info.append({"car_id":a.unique_id, 
-                                      "position": {
-                                          "x":a.pos[0],
-                                          "z":a.pos[1]
-                                      },
-                                   "current_direction":{
-                                       "x":a.current_direction[0],
-                                       "z":a.current_direction[1]
-                                        }
-                                     })
-            elif isinstance(a, Stoplight):
-                if a.color not in colors:
-                    self.stoplight_info.append({"stop_type":a.type,
-                                        "color":a.color})
-                    colors.append(a.color)
+        if since is not None and not self.frames.needs_keyframe(since, self.step_count):
+            added, changed, removed = self.frames.delta(since, self.step_count)
+            return json.dumps({"step": self.step_count, "since": since, "keyframe": False,
+                               "added": added, "changed": changed, "removed": removed,
+                               "stoplights": self.get_stoplight_info()})
 
+        frame = self.get_frame()
+        self.car_info = frame["cars"]
+        self.stoplight_info = frame["stoplights"]
         self.info = {"cars":self.car_info, "stoplights": self.stoplight_info}
+        if since is not None:
+            return json.dumps({"step": self.step_count, "keyframe": True, **self.info})
         return json.dumps(self.info)
     
+    def get_frame(self):
+        """
+        Returns the current frame as a dict: {"step", "cars", "stoplights"}.
+        """
+        return {"step": self.step_count,
+                "cars": [car_json(car_id, state) for car_id, state in self.frames.frames[self.step_count].items()],
+                "stoplights": self.get_stoplight_info()}
+
+    def latest_frame(self):
+        """
+        Returns the current step as a Frame, which stays valid while the model keeps stepping.
+        """
+        return Frame(self.step_count, self.frames.frames[self.step_count], self.get_stoplight_info())
+
+    def run_steps(self, steps, stride=1, binary=False):
+        """
+        Advances the model 'steps' steps and returns the frames of every 'stride'-th step,
+        the last one always included. Frames are dicts like get_frame, or bytes like
+        get_frame_bytes if 'binary'.
+        """
+        frames = []
+        for i in range(1, steps + 1):
+            self.step()
+            if i % stride == 0 or i == steps:
+                frames.append(self.get_frame_bytes() if binary else self.get_frame())
+        return frames
+
+    def get_frame_bytes(self):
+        """
+        Same frame as get_info, in the fixed-width binary format of frames.encode_binary.
+        """
+        return encode_binary(self.step_count, self.frames.frames[self.step_count], self.get_stoplight_info())
+
     def check_active(self):
-        try:
-            for a in self.schedule.agents:
-                if isinstance(a, Car):
-                    if not a.is_active:
-                        self.grid.remove_agent(a)
-                        self.schedule.remove(a)
-                        self.active_cars -= 1
-                        try: 
-                            del a
-                        except Exception as e:
-                            print(f"An error occurred: {e}")
-            self.check_available_spots()
-
-        except Exception as e:  # Catch specific exceptions here or use Exception for a general catch
-            print(f"An error occurred: {e}")
-            
+        """
+        Removes the cars that reached their goal this step, then spawns new ones if there is room.
+        Only the cars queued by Car.remove_car are visited, not every agent.
+        """
+        retiring, self.retiring = self.retiring, []
+        for car in retiring:
+            self.car_left(car.pos)
+            self.grid.remove_agent(car)
+            self.schedule.remove(car)
+            self.active_cars -= 1
+            self.recycle_car(car)
+        self.check_available_spots()
 
-    def step(self):
+    def step_cars(self):
+        self.search_expansions = 0
         self.schedule.step_type(Car)  # Call the step method for all agents
-        self.schedule.step_type(Stoplight)  # Call the step method for all agents
-        self.check_active()
+
+    def step_signals(self):
+        for cells in self.signals.tick():  # Change the stoplights' colors
+            self.cells_changed(cells)
+
+    def record_frame(self):
+        self.step_count += 1
+        self.frames.record(self.step_count, self.car_states())
+
+    def collect(self):
         self.datacollector.collect(self)  # Collect data for visualization
+
+    def step(self):
+        self.step_timer.run()
+
@@ -0,0 +1,105 @@
+import math
+import numpy as np
+
+# Compass directions used in the flow files and their unit offsets on the grid.
+DIRECTIONS = ("W", "S", "N", "E")
+DIRECTION_OFFSETS = {"W": (-1, 0), "S": (0, -1), "N": (0, 1), "E": (1, 0)}
+# Bit of each direction in a direction mask
+DIRECTION_BITS = {direction: 1 << i for i, direction in enumerate(DIRECTIONS)}
+
+
+class RoadGraph:
+    """
+    Immutable directed graph of the road network, compiled once from the cell layers.
+
+    Every cell of the grid has an integer id (x * height + y). The edges leaving cell i
+    are stored CSR-style: their targets are indices[indptr[i]:indptr[i + 1]] and their
+    costs are the same slice of costs. An edge leaving a cell that a car can never enter
+    (a building, a roundabout, an empty cell) costs math.inf, exactly like the old
+    per-expansion check did.
+    """
+    def __init__(self, directions, main_direction, passable):
+        """
+        Args:
+            directions: (width, height) uint8 array, bitmask of DIRECTION_BITS allowed from each cell.
+            main_direction: (width, height) int8 array, index into DIRECTIONS of the main flow or -1.
+            passable: (width, height) bool array, cells a car may enter when no car or red light is on them.
+        """
+        self.width, self.height = directions.shape
+        self.size = self.width * self.height
+
+        self.passable = np.array(passable, dtype=bool).reshape(-1)
+        self.main_direction = np.array(main_direction, dtype=np.int8).reshape(-1)
+
+        xs, ys = np.divmod(np.arange(self.size, dtype=np.int64), self.height)
+        mask = np.asarray(directions).reshape(-1)
+        sources, targets, order = [], [], []
+        for k, direction in enumerate(DIRECTIONS):
+            dx, dy = DIRECTION_OFFSETS[direction]
+            nx, ny = xs + dx, ys + dy
+            keep = ((mask & DIRECTION_BITS[direction]) != 0) & \
+                (nx >= 0) & (nx < self.width) & (ny >= 0) & (ny < self.height)
+            sources.append(np.flatnonzero(keep))
+            targets.append(nx[keep] * self.height + ny[keep])
+            order.append(np.full(int(keep.sum()), k))
+        sources = np.concatenate(sources)
+        targets = np.concatenate(targets)
+        # Edges grouped by source cell, in DIRECTIONS order within a cell
+        sort = np.lexsort((np.concatenate(order), sources))
+
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=self.size)))).astype(np.int64)
+        self.indices = targets[sort].astype(np.int64)
+        self.costs = np.where(self.passable[sources[sort]], 1.0, math.inf)
+
+        # Same edges grouped by target, to walk the graph backwards from a goal
+        sources = np.repeat(np.arange(self.size, dtype=np.int64), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind="stable")
+        self.rev_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.indices, minlength=self.size))))
+        self.rev_indices = sources[order]
+        self.rev_costs = self.costs[order]
+
+        for array in (self.passable, self.main_direction, self.indptr, self.indices, self.costs,
+                      self.rev_indptr, self.rev_indices, self.rev_costs):
+            array.flags.writeable = False
+
+        # Plain list copies for the search loops, indexing numpy scalars one by one is slow
+        self._indptr = self.indptr.tolist()
+        self._indices = self.indices.tolist()
+        self._costs = self.costs.tolist()
+        self._passable = self.passable.tolist()
+        self._rev_indptr = self.rev_indptr.tolist()
+        self._rev_indices = self.rev_indices.tolist()
+        self._rev_costs = self.rev_costs.tolist()
+
+    def cell_id(self, pos):
+        return pos[0] * self.height + pos[1]
+
+    def cell_pos(self, cell):
+        return divmod(cell, self.height)
+
+    def edges(self, cell):
+        """
+        Returns the (target, cost) pairs of the edges leaving a cell.
+        """
+        start, end = self._indptr[cell], self._indptr[cell + 1]
+        return zip(self._indices[start:end], self._costs[start:end])
+
+    def reverse_edges(self, cell):
+        """
+        Returns the (source, cost) pairs of the edges entering a cell.
+        """
+        start, end = self._rev_indptr[cell], self._rev_indptr[cell + 1]
+        return zip(self._rev_indices[start:end], self._rev_costs[start:end])
+
+    def has_edge(self, cell, target):
+        return target in self._indices[self._indptr[cell]:self._indptr[cell + 1]]
+
+    def main_direction_at(self, pos):
+        """
+        Returns the main flow letter of a cell, or None if it is not a road.
+        """
+        index = self.main_direction[self.cell_id(pos)]
+        return DIRECTIONS[index] if index >= 0 else None
+
+    def is_passable(self, cell):
+        return self._passable[cell]
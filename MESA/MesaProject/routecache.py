@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+
+class RouteCache:
+    """
+    Bounded LRU cache of the paths found by the car search, keyed by (start, goal).
+
+    A path only depends on the state of the cells its search generated, so every entry
+    remembers them along with the change counter at the time it was stored. The model
+    calls cell_changed when a car enters or leaves a cell or a stoplight turns red or
+    stops being red; an entry whose cells changed after it was stored is dropped on
+    lookup. Cached routes are always the ones a fresh search would return.
+
+    The cells that changed are also logged, changed_since tells the incremental
+    searches which cells to check again instead of scanning the grid.
+    """
+    def __init__(self, size, max_size=1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # (start, goal) -> [path, generated cells, stamp]
+        self.changes = 0
+        self.last_change = [0] * size  # Value of 'changes' when each cell last changed
+        self.log = []  # Cell of every change, log[i] was change number log_start + i + 1
+        self.log_start = 0
+        self.max_log = max(4 * size, 4096)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def cell_changed(self, cell):
+        self.changes += 1
+        self.last_change[cell] = self.changes
+        self.log.append(cell)
+        if len(self.log) > self.max_log:
+            drop = len(self.log) // 2
+            del self.log[:drop]
+            self.log_start += drop
+
+    def changed_since(self, stamp):
+        """
+        Returns the cells that changed after change number 'stamp' (with repeats), or
+        None if the log doesn't go back that far.
+        """
+        if stamp is None or stamp < self.log_start:
+            return None
+        return self.log[stamp - self.log_start:]
+
+    def get(self, start, goal):
+        """
+        Returns the cached path from 'start' to 'goal' as a tuple, or None on a miss.
+        """
+        key = (start, goal)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        path, generated, stamp = entry
+        if stamp != self.changes:
+            last_change = self.last_change
+            if any(last_change[cell] > stamp for cell in generated):
+                del self.entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            entry[2] = self.changes
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return path
+
+    def put(self, start, goal, path, generated):
+        if self.max_size <= 0:
+            return
+        key = (start, goal)
+        self.entries[key] = [tuple(path), tuple(generated), self.changes]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {"size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations}
@@ -1,29 +1,122 @@
-from typing import Callable, Optional, Type
+from typing import Callable, Optional, Type, Union, Iterable
 
 import mesa
 
+_MISSING = object()
+
+
+class TrackedAttribute:
+    """
+    An agent attribute whose changes update the scheduler's named counts.
+
+    Declare it on the agent class (running = TrackedAttribute()) and use it like a
+    normal attribute. When its value changes on a scheduled agent, the counts of the
+    named filters tracking it are updated for that agent only.
+    """
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return instance.__dict__[self.name]
+
+    def __set__(self, instance, value):
+        old = instance.__dict__.get(self.name, _MISSING)
+        instance.__dict__[self.name] = value
+        if old is not _MISSING and old != value:
+            schedule = getattr(instance.model, "schedule", None)
+            if isinstance(schedule, RandomActivationByTypeFiltered):
+                schedule.attribute_changed(instance, self.name)
+
+
+class _NamedFilter:
+    def __init__(self, type_class, predicate, attributes):
+        self.type_class = type_class
+        self.predicate = predicate
+        self.attributes = frozenset(attributes)
+        self.matching = set()  # Scheduled agents that satisfy the predicate
+
 
 class RandomActivationByTypeFiltered(mesa.time.RandomActivationByType):
     """
     A scheduler that overrides the get_type_count method to allow for filtering
     of agents by a function before counting.
 
+    Counts are kept up to date instead of recounted: the number of agents of a type
+    is the size of its dict, and named filters registered with add_filter keep the set
+    of agents matching them as agents are added, removed or change a tracked attribute.
+
     Example:
     >>> scheduler = RandomActivationByTypeFiltered(model)
     >>> scheduler.get_type_count(AgentA, lambda agent: agent.some_attribute > 10)
+    >>> scheduler.add_filter("big", AgentA, lambda agent: agent.some_attribute > 10, ["some_attribute"])
+    >>> scheduler.get_type_count(AgentA, "big")
     """
 
+    def __init__(self, model):
+        super().__init__(model)
+        self.filters = {}
+        self._filters_by_type = {}  # type -> filters of that type
+
+    def add_filter(
+        self,
+        name: str,
+        type_class: Type[mesa.Agent],
+        predicate: Callable[[mesa.Agent], bool],
+        attributes: Iterable[str] = (),
+    ) -> None:
+        """
+        Registers a named count of the agents of 'type_class' that satisfy 'predicate'.
+        'attributes' are the TrackedAttributes the predicate depends on, the agent is
+        checked again whenever one of them changes.
+        """
+        named = _NamedFilter(type_class, predicate, attributes)
+        named.matching = {agent for agent in self.agents_by_type[type_class].values() if predicate(agent)}
+        self.filters[name] = named
+        self._filters_by_type.setdefault(type_class, []).append(named)
+
+    def add(self, agent: mesa.Agent) -> None:
+        super().add(agent)
+        for named in self._filters_by_type.get(type(agent), ()):
+            if named.predicate(agent):
+                named.matching.add(agent)
+
+    def remove(self, agent: mesa.Agent) -> None:
+        super().remove(agent)
+        for named in self._filters_by_type.get(type(agent), ()):
+            named.matching.discard(agent)
+
+    def attribute_changed(self, agent: mesa.Agent, attribute: str) -> None:
+        """
+        Checks 'agent' again against the filters tracking 'attribute'.
+        """
+        filters = self._filters_by_type.get(type(agent))
+        if not filters or self.agents_by_type[type(agent)].get(agent.unique_id) is not agent:
+            return
+        for named in filters:
+            if attribute in named.attributes:
+                if named.predicate(agent):
+                    named.matching.add(agent)
+                else:
+                    named.matching.discard(agent)
+
     def get_type_count(
         self,
         type_class: Type[mesa.Agent],
-        filter_func: Optional[Callable[[mesa.Agent], bool]] = None,
+        filter_func: Optional[Union[str, Callable[[mesa.Agent], bool]]] = None,
     ) -> int:
         """
         Returns the current number of agents of certain type in the queue
-        that satisfy the filter function.
+        that satisfy the filter function. A filter registered with add_filter
+        can be given by name, its count is kept up to date and costs nothing to read.
         """
+        if filter_func is None:
+            return len(self.agents_by_type[type_class])
+        if isinstance(filter_func, str):
+            return len(self.filters[filter_func].matching)
         count = 0
         for agent in self.agents_by_type[type_class].values():
-            if filter_func is None or filter_func(agent):
+            if filter_func(agent):
                 count += 1
-        return count
\ No newline at end of file
+        return count
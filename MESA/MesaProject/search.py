@@ -0,0 +1,389 @@
+import math
+import heapq
+from collections import OrderedDict
+from typing import NamedTuple
+import numpy as np
+
+
+def euclidean_heuristic(graph, goal):
+    """
+    Returns a function with the Euclidean distance from a cell to 'goal'.
+    """
+    gx, gy = graph.cell_pos(goal)
+
+    def heuristic(cell):
+        x, y = graph.cell_pos(cell)
+        return math.sqrt((gx - x) ** 2 + (gy - y) ** 2)
+
+    return heuristic
+
+
+class SearchResult(NamedTuple):
+    """
+    Outcome of a search: the path of cell ids, the number of expansions and
+    the cells the search generated (the only ones whose state the result depends on).
+    """
+    path: list
+    expanded: int
+    generated: object
+
+
+class Landmarks:
+    """
+    ALT (A*, landmarks, triangle inequality) lower bounds for a RoadGraph.
+
+    A few landmark cells are picked far apart and the static distances from and to
+    each of them are precomputed. For any landmark L, d(u, v) >= d(L, v) - d(L, u)
+    and d(u, v) >= d(u, L) - d(v, L), which on a one-way network is a much tighter
+    bound than the straight-line distance.
+
+    The bounds are computed with numpy for every cell at once, the searches read them
+    from a table per goal (the last 'cache_size' goals are kept).
+    """
+    def __init__(self, graph, count=4, cache_size=32):
+        self.graph = graph
+        self.cells = []
+        forward = []  # forward[i][v]: distance from landmark i to v
+        backward = []  # backward[i][v]: distance from v to landmark i
+        self.cache_size = cache_size
+        self.tables = OrderedDict()  # goal -> bound of every cell to it
+        self.xs, self.ys = np.divmod(np.arange(graph.size, dtype=np.int64), graph.height)
+
+        roads = [cell for cell in range(graph.size) if graph._indptr[cell + 1] > graph._indptr[cell]]
+        if roads:
+            # Farthest point selection on round-trip distances, starting from the cell
+            # farthest from the first road
+            distance, _ = dijkstra(graph, roads[0])
+            reverse, _ = dijkstra(graph, roads[0], reverse=True)
+            closest = [distance[cell] + reverse[cell] for cell in range(graph.size)]
+            candidate = max(roads, key=lambda cell: closest[cell] if closest[cell] < math.inf else -1)
+            closest = [math.inf] * graph.size
+            while len(self.cells) < count and candidate not in self.cells:
+                self.cells.append(candidate)
+                distance, _ = dijkstra(graph, candidate)
+                reverse, _ = dijkstra(graph, candidate, reverse=True)
+                forward.append(distance)
+                backward.append(reverse)
+                for cell in roads:
+                    closest[cell] = min(closest[cell], distance[cell] + reverse[cell])
+                candidate = max(roads, key=lambda cell: closest[cell] if closest[cell] < math.inf else -1)
+        # (landmark, cell) arrays, math.inf where a cell can't reach or be reached
+        self.forward = np.array(forward, dtype=np.float64).reshape(len(self.cells), graph.size)
+        self.backward = np.array(backward, dtype=np.float64).reshape(len(self.cells), graph.size)
+
+    def bounds(self, source=None, goal=None):
+        """
+        Lower bounds of the static distance from every cell to the cell id 'goal', or
+        from the cell id 'source' to every cell, never below the Euclidean distance.
+        """
+        if goal is not None:
+            x, y = self.graph.cell_pos(goal)
+            ahead = _differences(self.forward[:, goal, None], self.forward)
+            behind = _differences(self.backward, self.backward[:, goal, None])
+        else:
+            x, y = self.graph.cell_pos(source)
+            ahead = _differences(self.forward, self.forward[:, source, None])
+            behind = _differences(self.backward[:, source, None], self.backward)
+        euclidean = np.sqrt((x - self.xs) ** 2 + (y - self.ys) ** 2)
+        return np.maximum(euclidean, np.maximum(ahead.max(axis=0, initial=0.0),
+                                                behind.max(axis=0, initial=0.0)))
+
+    def table(self, goal):
+        """
+        Bounds of every cell to 'goal', computed once for the goals used lately.
+        """
+        table = self.tables.get(goal)
+        if table is None:
+            table = self.tables[goal] = memoryview(self.bounds(goal=goal))
+            if len(self.tables) > self.cache_size:
+                self.tables.popitem(last=False)
+        else:
+            self.tables.move_to_end(goal)
+        return table
+
+    def heuristic(self, goal):
+        """
+        Returns a function with the bound from a cell to 'goal', never below the Euclidean distance.
+        """
+        return self.table(goal).__getitem__
+
+    def heuristic_from(self, source):
+        """
+        Returns a function with the bound from 'source' to a cell, never below the Euclidean distance.
+        """
+        return memoryview(self.bounds(source=source)).__getitem__
+
+
+def _differences(minuend, subtrahend):
+    """
+    Element-wise minuend - subtrahend where both are finite, 0 elsewhere.
+    """
+    with np.errstate(invalid="ignore"):
+        return np.where(np.isfinite(minuend) & np.isfinite(subtrahend), minuend - subtrahend, 0.0)
+
+
+def reconstruct_path(came_from, current):
+    """
+    Reconstructs the path from start to goal using the 'came_from' dictionary.
+    """
+    total_path = [current]
+    while current in came_from:
+        current = came_from[current]
+        total_path.append(current)
+    return total_path[::-1]
+
+
+def a_star(graph, start, goal, is_blocked=None, heuristic=None):
+    """
+    A* search over a compiled RoadGraph, from cell id 'start' to cell id 'goal'.
+
+    Cells for which 'is_blocked' is true (other cars, red lights) are still reachable
+    but cost math.inf to leave and get an infinite heuristic, the start cell is never blocked.
+    Returns a SearchResult, its path holds the cell ids from start to goal or is [] if there is none.
+    """
+    if heuristic is None:
+        heuristic = euclidean_heuristic(graph, goal)
+    passable = graph._passable
+    indptr, indices, costs = graph._indptr, graph._indices, graph._costs
+
+    if is_blocked is None:
+        def blocked(cell):
+            return cell != start and not passable[cell]
+    else:
+        def blocked(cell):
+            return cell != start and (not passable[cell] or is_blocked(cell))
+
+    counter = 0
+    frontier = [(0, counter, start)]
+    came_from = {}
+    cost_so_far = {start: 0}
+    expanded = {}  # Cost each cell was last expanded with, expanding it again is a no-op
+    expansions = 0
+
+    while frontier:
+        current = heapq.heappop(frontier)[2]
+
+        if current == goal:
+            return SearchResult(reconstruct_path(came_from, goal), expansions, cost_so_far.keys())
+
+        cost = cost_so_far[current]
+        if expanded.get(current) == cost:
+            continue
+        expanded[current] = cost
+        expansions += 1
+
+        current_blocked = blocked(current)
+        for i in range(indptr[current], indptr[current + 1]):
+            next_cell = indices[i]
+            new_cost = cost + (math.inf if current_blocked else costs[i])
+            if next_cell not in cost_so_far or new_cost < cost_so_far[next_cell]:
+                cost_so_far[next_cell] = new_cost
+                priority = new_cost + (math.inf if blocked(next_cell) else heuristic(next_cell))
+                counter += 1
+                heapq.heappush(frontier, (priority, counter, next_cell))
+                came_from[next_cell] = current
+
+    return SearchResult([], expansions, cost_so_far.keys())  # If no path found
+
+
+def dijkstra(graph, source, reverse=False):
+    """
+    Static shortest distances from 'source' to every cell of a RoadGraph, or from
+    every cell to 'source' if 'reverse'. Returns the distance list and, for every
+    cell, the cell it was reached from (-1 if none): with 'reverse' that is the
+    next hop towards 'source'.
+    """
+    edges = graph.reverse_edges if reverse else graph.edges
+    distance = [math.inf] * graph.size
+    parent = [-1] * graph.size
+    distance[source] = 0
+    frontier = [(0, source)]
+    while frontier:
+        cost, current = heapq.heappop(frontier)
+        if cost > distance[current]:
+            continue
+        for other, edge_cost in edges(current):
+            new_cost = cost + edge_cost
+            if new_cost < distance[other]:
+                distance[other] = new_cost
+                parent[other] = current
+                heapq.heappush(frontier, (new_cost, other))
+    return distance, parent
+
+
+class FlowField:
+    """
+    Distance to a goal cell and next hop towards it from every cell of a RoadGraph,
+    computed once with a Dijkstra search over the reversed graph. Only static costs
+    are used, cars and red lights are left to the car's own move checks.
+    """
+    def __init__(self, graph, goal):
+        self.graph = graph
+        self.goal = goal
+
+        distance, next_hop = dijkstra(graph, goal, reverse=True)
+        self.distance = np.array(distance, dtype=np.float64)
+        self.next_hop = np.array(next_hop, dtype=np.int64)
+        self.distance.flags.writeable = False
+        self.next_hop.flags.writeable = False
+        # Views of the same buffers, their items are Python scalars and read faster than the arrays'
+        self._distance = memoryview(self.distance)
+        self._next_hop = memoryview(self.next_hop)
+
+    def next_cell(self, cell):
+        """
+        Returns the id of the next cell towards the goal, or -1 if the goal can't be reached.
+        """
+        return self._next_hop[cell]
+
+    def remaining_distance(self, cell):
+        return self._distance[cell]
+
+
+# Extra cost of leaving a cell held by a car or a red light in the incremental search.
+# A finite penalty keeps the g-values meaningful while a few cells are blocked.
+BLOCKED_PENALTY = 1e6
+
+
+class DStarLite:
+    """
+    D* Lite (Koenig & Likhachev) over a RoadGraph, for one car and one goal.
+
+    The search runs backwards from the goal and keeps its g/rhs values between calls.
+    When the car moves or cells get blocked or freed, replan() only repairs the
+    vertices around the changes instead of searching again from scratch. The caller
+    reports those cells with cells_changed (or all the blocked ones with set_blocked),
+    'stamp' is free for it to remember up to when it did.
+    """
+    def __init__(self, graph, start, goal, landmarks=None):
+        self.graph = graph
+        self.landmarks = landmarks
+        self.goal = goal
+        self.start = start
+        self.km = 0
+        self.g = {}
+        self.rhs = {goal: 0}
+        self.queue = []
+        self.open = {}  # cell -> key of its valid entry in 'queue'
+        self.blocked = set()
+        self.changed = set()  # Cells whose blocked state changed since the last replan
+        self.stamp = None
+        self.expansions = 0
+        self.heuristic = self.heuristic_from(start)  # Lower bound of the distance from start to a cell
+        self._push(goal)
+
+    def heuristic_from(self, start):
+        if self.landmarks is None:
+            return euclidean_heuristic(self.graph, start)
+        return self.landmarks.heuristic_from(start)
+
+    def calculate_key(self, cell):
+        best = min(self.g.get(cell, math.inf), self.rhs.get(cell, math.inf))
+        return (best + self.heuristic(cell) + self.km, best)
+
+    def cost(self, cell, edge_cost):
+        if cell != self.start and cell in self.blocked:
+            return edge_cost + BLOCKED_PENALTY
+        return edge_cost
+
+    def _push(self, cell):
+        key = self.calculate_key(cell)
+        self.open[cell] = key
+        heapq.heappush(self.queue, (key[0], key[1], cell))
+
+    def _top(self):
+        while self.queue:
+            k1, k2, cell = self.queue[0]
+            if self.open.get(cell) == (k1, k2):
+                return (k1, k2), cell
+            heapq.heappop(self.queue)  # Stale entry
+        return (math.inf, math.inf), None
+
+    def update_vertex(self, cell):
+        if cell != self.goal:
+            g = self.g
+            self.rhs[cell] = min((self.cost(cell, edge_cost) + g.get(target, math.inf)
+                                  for target, edge_cost in self.graph.edges(cell)), default=math.inf)
+        self.open.pop(cell, None)
+        if self.g.get(cell, math.inf) != self.rhs.get(cell, math.inf):
+            self._push(cell)
+
+    def compute_shortest_path(self):
+        while True:
+            top_key, cell = self._top()
+            if cell is None:
+                return
+            start_g = self.g.get(self.start, math.inf)
+            start_rhs = self.rhs.get(self.start, math.inf)
+            if not (top_key < self.calculate_key(self.start) or start_rhs != start_g):
+                return
+
+            self.expansions += 1
+            new_key = self.calculate_key(cell)
+            if top_key < new_key:
+                self._push(cell)
+            elif self.g.get(cell, math.inf) > self.rhs.get(cell, math.inf):
+                self.g[cell] = self.rhs[cell]
+                del self.open[cell]
+                for previous, _ in self.graph.reverse_edges(cell):
+                    self.update_vertex(previous)
+            else:
+                self.g[cell] = math.inf
+                self.update_vertex(cell)
+                for previous, _ in self.graph.reverse_edges(cell):
+                    self.update_vertex(previous)
+
+    def set_blocked(self, blocked):
+        """
+        Replaces the blocked cells with the set 'blocked'.
+        """
+        self.changed.update(self.blocked.symmetric_difference(blocked))
+        self.blocked = set(blocked)
+
+    def cells_changed(self, cells, is_blocked):
+        """
+        Reads the blocked state of 'cells', the only ones that may have changed, with 'is_blocked'.
+        """
+        blocked = self.blocked
+        for cell in cells:
+            if is_blocked(cell):
+                if cell not in blocked:
+                    blocked.add(cell)
+                    self.changed.add(cell)
+            elif cell in blocked:
+                blocked.discard(cell)
+                self.changed.add(cell)
+
+    def replan(self, start):
+        """
+        Moves the search to 'start', applies the cells whose blocked state changed
+        and returns the path of cell ids from start to goal, or [] if there is none.
+        """
+        changed, self.changed = self.changed, set()
+        if start != self.start:
+            changed.update((self.start, start))
+            self.km += self.heuristic(start)  # Still the bound from the last start
+            self.start = start
+            self.heuristic = self.heuristic_from(start)
+        for cell in changed:
+            self.update_vertex(cell)
+        self.compute_shortest_path()
+        return self.path()
+
+    def path(self):
+        if self.g.get(self.start, math.inf) == math.inf and self.rhs.get(self.start, math.inf) == math.inf:
+            return []
+        g = self.g
+        current = self.start
+        path = [current]
+        while current != self.goal and len(path) <= self.graph.size:
+            best, best_cost = None, math.inf
+            for target, edge_cost in self.graph.edges(current):
+                cost = self.cost(current, edge_cost) + g.get(target, math.inf)
+                if cost < best_cost:
+                    best, best_cost = target, cost
+            if best is None:
+                return []
+            current = best
+            path.append(current)
+        return path if current == self.goal else []
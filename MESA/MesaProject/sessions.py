@@ -0,0 +1,373 @@
+import re
+import time
+import threading
+import multiprocessing
+from model import StreetView
+from driver import SimulationDriver, FrameFeed
+
+# Session ids clients may send, anything else is rejected
+SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class SessionLimitError(Exception):
+    """
+    Raised when a new session is asked for and every slot holds an active one.
+    """
+
+
+class Session:
+    """
+    One client's simulation, with its own StreetView running in this process.
+
+    Every step publishes the new frame to 'feed', so the latest frame can be read
+    (and streamed) without taking the model's lock.
+    """
+    def __init__(self, session_id, model_kwargs=None):
+        self.id = session_id
+        self.model = StreetView(**(model_kwargs or {}))
+        self.lock = threading.Lock()
+        self.feed = FrameFeed(self.model.latest_frame())
+        self.driver = None
+        self.last_used = time.monotonic()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def start_background(self, tick_rate=None):
+        self.driver = SimulationDriver(self.model, tick_rate, self.lock, self.feed)
+        self.driver.start()
+
+    def step(self):
+        with self.lock:
+            self.model.step()
+            frame = self.model.latest_frame()
+        self.feed.publish(frame)
+
+    def run_steps(self, steps, stride=1, binary=False):
+        with self.lock:
+            frames = self.model.run_steps(steps, stride, binary)
+            frame = self.model.latest_frame()
+        self.feed.publish(frame)
+        return frames
+
+    def get_info(self, since=None):
+        with self.lock:
+            return self.model.get_info(since)
+
+    def metrics(self):
+        """
+        Returns the step timing summary of the model, with its route cache stats.
+        """
+        with self.lock:
+            return _model_metrics(self.model)
+
+    def configure_metrics(self, enabled=None, profile_steps=None):
+        """
+        Turns the step timing on or off and/or starts a cProfile capture of the next steps.
+        """
+        with self.lock:
+            _configure_timer(self.model.step_timer, enabled, profile_steps)
+
+    def profile_report(self):
+        with self.lock:
+            return self.model.step_timer.last_profile
+
+    def close(self):
+        if self.driver is not None:
+            self.driver.stop()
+        self.feed.close()
+
+
+def _model_metrics(model):
+    return {"step": model.step_count, "timing": model.step_timer.summary(),
+            "route_cache": model.route_cache.stats()}
+
+
+def _configure_timer(timer, enabled, profile_steps):
+    if enabled is not None:
+        timer.enable() if enabled else timer.disable()
+    if profile_steps:
+        timer.profile(profile_steps)
+
+
+def _serve(conn):
+    """
+    Main loop of a worker process: runs the StreetViews of the sessions it was given
+    and answers the (command, session id, args) messages of the server one at a time.
+    """
+    models = {}
+    while True:
+        try:
+            command, session_id, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            if command == "create":
+                model = models[session_id] = StreetView(**args[0])
+                result = model.latest_frame()
+            elif command == "close":
+                models.pop(session_id, None)
+                result = None
+            else:
+                model = models[session_id]
+                if command == "step":
+                    model.step()
+                    result = model.latest_frame()
+                elif command == "run_steps":
+                    frames = model.run_steps(*args)
+                    result = (frames, model.latest_frame())
+                elif command == "get_info":
+                    result = model.get_info(*args)
+                elif command == "metrics":
+                    result = _model_metrics(model)
+                elif command == "configure_metrics":
+                    result = _configure_timer(model.step_timer, *args)
+                elif command == "profile_report":
+                    result = model.step_timer.last_profile
+                else:
+                    raise ValueError(f"Unknown command {command!r}")
+        except Exception as error:
+            conn.send((False, f"{type(error).__name__}: {error}"))
+        else:
+            conn.send((True, result))
+
+
+class Worker:
+    """
+    A process running the models of some sessions, so they step on their own core.
+    """
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.lock = threading.Lock()  # One request on the pipe at a time
+        self.sessions = 0
+
+    def call(self, command, session_id, *args):
+        with self.lock:
+            self.conn.send((command, session_id, args))
+            ok, result = self.conn.recv()
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def shutdown(self):
+        self.conn.close()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class WorkerSession(Session):
+    """
+    A Session whose StreetView lives in one of the pool's worker processes.
+    Same interface as Session, frames come back over the worker's pipe.
+    """
+    def __init__(self, session_id, worker, model_kwargs=None):
+        self.id = session_id
+        self.model = None
+        self.worker = worker  # Its session count was taken by the manager when it picked it
+        self.feed = FrameFeed(worker.call("create", session_id, model_kwargs or {}))
+        self.driver = None
+        self.last_used = time.monotonic()
+
+    def start_background(self, tick_rate=None):
+        raise RuntimeError("sessions in worker processes can't run in the background")
+
+    def step(self):
+        self.feed.publish(self.worker.call("step", self.id))
+
+    def run_steps(self, steps, stride=1, binary=False):
+        frames, frame = self.worker.call("run_steps", self.id, steps, stride, binary)
+        self.feed.publish(frame)
+        return frames
+
+    def get_info(self, since=None):
+        return self.worker.call("get_info", self.id, since)
+
+    def metrics(self):
+        return self.worker.call("metrics", self.id)
+
+    def configure_metrics(self, enabled=None, profile_steps=None):
+        self.worker.call("configure_metrics", self.id, enabled, profile_steps)
+
+    def profile_report(self):
+        return self.worker.call("profile_report", self.id)
+
+    def close(self):
+        # The worker's session count was given back by the manager when it removed the session
+        self.worker.call("close", self.id)
+        self.feed.close()
+
+
+class _PendingSession:
+    """
+    Slot of a session being created, the other requests for it wait on 'ready'.
+    """
+    def __init__(self):
+        self.ready = threading.Event()
+        self.session = None
+        self.error = None
+
+
+class SessionManager:
+    """
+    The sessions of the server, keyed by the id the client sends.
+
+    Sessions are created on the first request that names them. At most 'max_sessions'
+    exist at once, the ones not used for 'idle_timeout' seconds are evicted to make
+    room (or by the reaper thread). New sessions are built outside the manager's lock,
+    requests for the other sessions don't wait for them. With 'workers' > 0 the models run in that many
+    worker processes, new sessions going to the least loaded one; otherwise they run
+    in the server process, stepped on a background thread each if 'background'.
+    """
+    def __init__(self, max_sessions=16, idle_timeout=600, model_kwargs=None, workers=0,
+                 background=False, tick_rate=None):
+        if workers and background:
+            raise ValueError("Background sessions can't run in worker processes")
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.model_kwargs = model_kwargs or {}
+        self.background = background
+        self.tick_rate = tick_rate
+        self.sessions = {}
+        self.creating = {}  # Session id -> _PendingSession, counted against max_sessions
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.workers = []
+        if workers:
+            context = multiprocessing.get_context("spawn")
+            self.workers = [Worker(context) for _ in range(workers)]
+        self._reaper = None
+        self._stop = threading.Event()
+
+    def get(self, session_id):
+        """
+        Returns the session named 'session_id', creating it if needed.
+        Raises SessionLimitError if it would go over max_sessions.
+        """
+        evicted = []
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.touch()
+                return session
+            pending = self.creating.get(session_id)
+            creator = full = False
+            if pending is None:
+                if len(self.sessions) + len(self.creating) >= self.max_sessions:
+                    evicted = self._evict_idle()
+                full = len(self.sessions) + len(self.creating) >= self.max_sessions
+                if not full:
+                    # Slot reserved, the model is built without holding the lock
+                    pending = self.creating[session_id] = _PendingSession()
+                    worker = self._pick_worker()
+                    creator = True
+        for idle in evicted:
+            idle.close()
+        if full:
+            raise SessionLimitError(f"all {self.max_sessions} sessions are in use")
+
+        if not creator:
+            pending.ready.wait()
+            if pending.error is not None:
+                raise pending.error
+            pending.session.touch()
+            return pending.session
+
+        try:
+            session = self._create(session_id, worker)
+        except Exception as error:
+            with self.lock:
+                del self.creating[session_id]
+                if worker is not None:
+                    worker.sessions -= 1
+            pending.error = error
+            pending.ready.set()
+            raise
+        with self.lock:
+            del self.creating[session_id]
+            self.sessions[session_id] = session
+            session.touch()
+        pending.session = session
+        pending.ready.set()
+        return session
+
+    def _pick_worker(self):
+        """
+        Least loaded worker process, counted as holding one more session. Caller holds the lock.
+        """
+        if not self.workers:
+            return None
+        worker = min(self.workers, key=lambda w: w.sessions)
+        worker.sessions += 1
+        return worker
+
+    def _create(self, session_id, worker):
+        if worker is not None:
+            return WorkerSession(session_id, worker, self.model_kwargs)
+        session = Session(session_id, self.model_kwargs)
+        if self.background:
+            session.start_background(self.tick_rate)
+        return session
+
+    def _remove(self, session_id):
+        """
+        Takes the session off the manager and gives back its worker slot, caller holds the lock.
+        """
+        session = self.sessions.pop(session_id)
+        if isinstance(session, WorkerSession):
+            session.worker.sessions -= 1
+        return session
+
+    def close(self, session_id):
+        with self.lock:
+            session = self._remove(session_id) if session_id in self.sessions else None
+        if session is not None:
+            session.close()
+        return session is not None
+
+    def _evict_idle(self):
+        """
+        Removes the sessions idle for longer than idle_timeout and returns them, caller
+        holds the lock and closes them once it released it.
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        idle = [s.id for s in self.sessions.values() if s.last_used < deadline]
+        self.evictions += len(idle)
+        return [self._remove(session_id) for session_id in idle]
+
+    def start_reaper(self, interval=None):
+        """
+        Evicts idle sessions every 'interval' seconds on a daemon thread, so idle
+        background sessions stop stepping even when no new session is asked for.
+        """
+        interval = interval or max(self.idle_timeout / 4, 1)
+
+        def reap():
+            while not self._stop.wait(interval):
+                with self.lock:
+                    evicted = self._evict_idle()
+                for session in evicted:
+                    session.close()
+
+        self._reaper = threading.Thread(target=reap, name="session-reaper", daemon=True)
+        self._reaper.start()
+
+    def shutdown(self):
+        self._stop.set()
+        with self.lock:
+            sessions = [self._remove(session_id) for session_id in list(self.sessions)]
+        for session in sessions:
+            session.close()
+        for worker in self.workers:
+            worker.shutdown()
+
+    def stats(self):
+        with self.lock:
+            return {"sessions": len(self.sessions),
+                    "creating": len(self.creating),
+                    "max_sessions": self.max_sessions,
+                    "evictions": self.evictions,
+                    "workers": len(self.workers)}
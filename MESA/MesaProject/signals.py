@@ -0,0 +1,66 @@
+import numpy as np
+from layers import SIGNAL_CODES
+
+
+class SignalController:
+    """
+    Computes the colour of every stoplight from the global step number.
+
+    A cycle lasts 20 steps: green for 8, yellow for 2 and red for 10. Each group of
+    stoplights starts at its own phase offset, group "A" starts green and group "B"
+    half a cycle later, so it starts red. Nothing runs per stoplight: on a colour
+    change the group's cells are updated at once in the signal layer.
+    """
+    cycle = 20
+    green_steps = 8
+    yellow_steps = 2
+    offsets = {"A": 0, "B": 10}
+
+    def __init__(self, layers, stoplights):
+        self.layers = layers
+        self.step_number = 0
+        cells = {}
+        self.fixed = {}  # Groups without a phase offset keep their initial colour
+        for stoplight in stoplights:
+            cells.setdefault(stoplight.type, []).append(stoplight.pos[0] * layers.height + stoplight.pos[1])
+            if stoplight.type not in self.offsets:
+                self.fixed[stoplight.type] = stoplight.initial_color
+        self.cells = {group: np.array(ids, dtype=np.int64) for group, ids in cells.items()}
+        self.colors = {group: self.compute_color(group) for group in self.cells}
+        for group, color in self.colors.items():
+            layers.signal_flat[self.cells[group]] = SIGNAL_CODES[color]
+
+    def compute_color(self, group, step_number=None):
+        """
+        Colour of a group at a step number, the current one by default.
+        """
+        if group in self.fixed:
+            return self.fixed[group]
+        if step_number is None:
+            step_number = self.step_number
+        phase = (step_number + self.offsets[group]) % self.cycle
+        if phase < self.green_steps:
+            return "green"
+        if phase < self.green_steps + self.yellow_steps:
+            return "yellow"
+        return "red"
+
+    def color(self, group):
+        return self.colors[group]
+
+    def tick(self):
+        """
+        Advances the clock one step. Returns the cell ids of the groups that turned red
+        or stopped being red, whose cost changed for the cars' search.
+        """
+        self.step_number += 1
+        changed = []
+        for group, cells in self.cells.items():
+            color = self.compute_color(group)
+            if color == self.colors[group]:
+                continue
+            if (color == "red") != (self.colors[group] == "red"):
+                changed.append(cells)
+            self.colors[group] = color
+            self.layers.signal_flat[cells] = SIGNAL_CODES[color]
+        return changed
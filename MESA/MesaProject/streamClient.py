@@ -0,0 +1,71 @@
+import json
+import time
+import argparse
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from urllib.request import Request, urlopen
+
+
+def read_events(response):
+    """
+    Yields the (event, id, data) of a Server-Sent Events response, skipping comments.
+    """
+    event, event_id, data = "message", None, []
+    for raw in response:
+        line = raw.decode("utf-8").rstrip("\r\n")
+        if not line:
+            if data:
+                yield event, event_id, "\n".join(data)
+            event, event_id, data = "message", None, []
+        elif line.startswith(":"):
+            continue
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "id":
+                event_id = value
+            elif field == "data":
+                data.append(value)
+
+
+def with_query(url, **params):
+    """
+    Returns 'url' with 'params' added to its query string, replacing the ones it already has.
+    """
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key not in params]
+    query += [(key, str(value)) for key, value in params.items()]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local client of the /streamPositions frame stream.")
+    parser.add_argument('--url', default="http://127.0.0.1:8000/streamPositions")
+    parser.add_argument('--frames', type=int, default=100, help="frames to read before closing")
+    parser.add_argument('--delay', type=float, default=0,
+                        help="seconds to sleep after each frame, to act as a slow consumer")
+    args = parser.parse_args()
+
+    request = Request(with_query(args.url, limit=args.frames), headers={"Accept": "text/event-stream"})
+    received, skipped, last_step = 0, 0, None
+    start = time.monotonic()
+    with urlopen(request) as response:
+        for event, event_id, data in read_events(response):
+            if event != "frame":
+                continue
+            step = int(event_id)
+            frame = json.loads(data)
+            if last_step is not None:
+                skipped += step - last_step - 1
+            last_step = step
+            received += 1
+            print(f"step {step}: {len(frame['cars'])} cars")
+            if args.delay:
+                time.sleep(args.delay)
+    elapsed = time.monotonic() - start
+    print(f"{received} frames in {elapsed:.2f}s, {skipped} skipped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import os
+import math
+import pytest
+from agents import Car
+from frames import decode_binary, encode_binary
+from layout import load_layout
+from model import StreetView
+from roadgraph import RoadGraph
+from search import DStarLite, Landmarks, dijkstra
+
+LAYOUT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run(steps, **kwargs):
+    """
+    Steps a seeded model and returns its frame and the path of every car after each step.
+    """
+    model = StreetView(layout_dir=LAYOUT_DIR, layout_cache=False, **kwargs)
+    history = []
+    for _ in range(steps):
+        model.step()
+        paths = {car.unique_id: tuple(car.path) for car in model.schedule.agents_by_type[Car].values()}
+        history.append((model.get_frame(), paths))
+    return history
+
+
+@pytest.mark.parametrize("seed", [1, 2, 7])
+def test_route_cache_keeps_routes(seed):
+    assert run(150, seed=seed) == run(150, seed=seed, route_cache_size=0)
+
+
+def test_binary_frame_round_trip():
+    cars = {0: (3, 4, 0, 1), 7: (0, 23, -1, 0), 2 ** 32 - 1: (32767, -32768, 1, -1)}
+    stoplights = [{"stop_type": "A", "color": "green"}, {"stop_type": "B", "color": "red"},
+                  {"stop_type": "N/A", "color": "yellow"}]
+    frame = decode_binary(encode_binary(12, cars, stoplights))
+    assert frame["step"] == 12
+    assert frame["cars"] == [{"car_id": car_id, "position": {"x": x, "z": z},
+                              "current_direction": {"x": dx, "z": dz}}
+                             for car_id, (x, z, dx, dz) in cars.items()]
+    assert frame["stoplights"] == stoplights
+    assert decode_binary(encode_binary(0, {}, [])) == {"step": 0, "cars": [], "stoplights": []}
+    with pytest.raises(ValueError):
+        decode_binary(b"JSON" + encode_binary(0, {}, [])[4:])
+
+
+def test_model_binary_frames_match_json():
+    model = StreetView(layout_dir=LAYOUT_DIR, layout_cache=False, seed=3)
+    for _ in range(30):
+        model.step()
+        assert decode_binary(model.get_frame_bytes()) == model.get_frame()
+        assert decode_binary(model.latest_frame().to_bytes()) == model.get_frame()
+
+
+@pytest.fixture(scope="module")
+def road_graph():
+    layout = load_layout(LAYOUT_DIR, cache=False)
+    graph = RoadGraph(layout.directions, layout.main_direction, layout.passable)
+    goals = [graph.cell_id((x, y)) for x, y, _ in layout.parking_spots()]
+    return graph, goals
+
+
+def path_cost(graph, path):
+    return sum(dict(graph.edges(cell))[target] for cell, target in zip(path, path[1:]))
+
+
+@pytest.mark.parametrize("alt", [False, True])
+def test_d_star_lite_matches_dijkstra(road_graph, alt):
+    graph, goals = road_graph
+    landmarks = Landmarks(graph) if alt else None
+    for start in range(0, graph.size, 11):
+        distance, _ = dijkstra(graph, start)
+        for goal in goals:
+            planner = DStarLite(graph, start, goal, landmarks)
+            path = planner.replan(start)
+            if distance[goal] == math.inf:
+                assert path == []
+            else:
+                assert planner.g[start] == pytest.approx(distance[goal])
+                assert path[0] == start and path[-1] == goal
+                assert path_cost(graph, path) == pytest.approx(distance[goal])
+
+
+@pytest.mark.parametrize("alt", [False, True])
+def test_d_star_lite_repairs_like_a_new_search(road_graph, alt):
+    graph, goals = road_graph
+    landmarks = Landmarks(graph) if alt else None
+    for goal in goals[::3]:
+        distance, _ = dijkstra(graph, goal, reverse=True)
+        start = next(cell for cell in range(0, graph.size, 13) if 10 < distance[cell] < math.inf)
+        planner = DStarLite(graph, start, goal, landmarks)
+        path = planner.replan(start)
+        blocked = set()
+
+        def check(cells):
+            planner.cells_changed(cells, blocked.__contains__)
+            fresh = DStarLite(graph, start, goal, landmarks)
+            fresh.set_blocked(blocked)
+            fresh.replan(start)
+            assert planner.replan(start)
+            assert planner.g[start] == pytest.approx(fresh.g[start])
+            # Every rhs still matches its successors, missed changes would leave stale ones
+            for cell, rhs in planner.rhs.items():
+                if cell != goal:
+                    assert rhs == min(planner.cost(cell, cost) + planner.g.get(target, math.inf)
+                                      for target, cost in graph.edges(cell))
+
+        for _ in range(int(distance[start])):
+            if len(path) < 5:
+                break
+            # Block the cells ahead and free them again, then move one cell
+            ahead = path[2:5]
+            blocked.update(ahead)
+            check(ahead)
+            blocked.difference_update(ahead)
+            check(ahead)
+            start = path[1]
+            path = planner.replan(start)
@@ -0,0 +1,58 @@
+using System;
+using System.Collections.Generic;
+using UnityEngine;
+
+// Reader for the binary frames of /getPositions?format=binary (see frames.py).
+// Little-endian: a 16 byte header, 2 bytes per stoplight group, 10 bytes per car.
+public class FrameDecoder
+{
+    public struct CarRecord
+    {
+        public uint carId;
+        public Vector2Int position;
+        public Vector2Int direction;
+    }
+
+    public struct StoplightRecord
+    {
+        public string stopType;
+        public string color;
+    }
+
+    static readonly string[] StopTypes = { "A", "B", "N/A" };
+    static readonly string[] Colors = { "green", "yellow", "red" };
+
+    public static uint Decode( byte[] data, List<CarRecord> cars, List<StoplightRecord> stoplights )
+    {
+        if (data[0] != 'S' || data[1] != 'V' || data[2] != 'F' || data[3] != '1')
+        {
+            throw new ArgumentException("Not a binary frame");
+        }
+        uint step = BitConverter.ToUInt32(data, 4);
+        uint carCount = BitConverter.ToUInt32(data, 8);
+        ushort stoplightCount = BitConverter.ToUInt16(data, 12);
+
+        int offset = 16;
+        stoplights.Clear();
+        for (int i = 0; i < stoplightCount; i++)
+        {
+            StoplightRecord s = new StoplightRecord();
+            s.stopType = StopTypes[data[offset]];
+            s.color = Colors[data[offset + 1]];
+            stoplights.Add(s);
+            offset += 2;
+        }
+
+        cars.Clear();
+        for (int i = 0; i < carCount; i++)
+        {
+            CarRecord c = new CarRecord();
+            c.carId = BitConverter.ToUInt32(data, offset);
+            c.position = new Vector2Int(BitConverter.ToInt16(data, offset + 4), BitConverter.ToInt16(data, offset + 6));
+            c.direction = new Vector2Int((sbyte)data[offset + 8], (sbyte)data[offset + 9]);
+            cars.Add(c);
+            offset += 10;
+        }
+        return step;
+    }
+}